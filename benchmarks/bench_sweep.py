@@ -0,0 +1,251 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# benchmark the pysweep of this checkout, also when another version is installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pysweep
+from pysweep.core.measurementfunctions import MakeMeasurementFunction
+from pysweep.databackends.base import DataParameterFixedAxis
+
+'''
+Benchmarks of the overhead that pysweep adds to every measured point.
+
+The instruments are simulated by parameters and measurement functions that either return immediately or sleep a fixed
+time, so the numbers only depend on the sweep loop and the databackend. Every case is a pysweep.sweep() over a fixed
+total number of points, varied in sweep depth, number of measured columns, scalar or array (DataParameterFixedAxis)
+data and databackend. The overhead per point is the wall time minus the simulated instrument time, divided by the
+number of points.
+
+The script imports pysweep from the repository it is in, run it for example from the root of the repository:
+
+    python benchmarks/bench_sweep.py
+    python benchmarks/bench_sweep.py --backends list spyview --latency 0.001 --output results.json
+
+With --output the results are written as json, together with the commit and the versions of python and numpy, such
+that runs can be compared over time. Backends that can not be imported or that do not support a case are reported as
+such and skipped.
+'''
+
+
+class FakeParameter:
+    def __init__(self, name, latency=0):
+        # a qcodes-like parameter, setting it takes latency seconds
+        self.name = name
+        self.unit = 'V'
+        self.latency = latency
+        self.value = 0
+        self.busy = 0  # total simulated instrument time
+
+    def set(self, value):
+        if self.latency:
+            time.sleep(self.latency)
+            self.busy += self.latency
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def make_measure(ncolumns, latency, array_points):
+    '''
+    A measurement function that returns ncolumns values
+
+    :param ncolumns: number of measured columns
+    :param latency: seconds every measurement takes
+    :param array_points: when not None, every column is an array of this length on a DataParameterFixedAxis
+    :return: the MeasurementFunction and a FakeParameter that accumulates the simulated measurement time
+    '''
+    instrument = FakeParameter('instrument', latency)
+    if array_points is None:
+        values = [float(i) for i in range(ncolumns)]
+
+        @MakeMeasurementFunction([['m'+str(i), 'A'] for i in range(ncolumns)])
+        def measure(dict_waterfall):
+            instrument.set(0)
+            return list(values)
+    else:
+        axis = np.linspace(0, 1, array_points)
+        trace = np.random.random(array_points)
+        paramstruct = [DataParameterFixedAxis('f', 'Hz', 'array', axis)]
+        # the axis is an independent, so the array columns depend on it like on the sweeps
+        paramstruct += [['m'+str(i), 'A', 'array'] for i in range(ncolumns)]
+
+        @MakeMeasurementFunction(paramstruct)
+        def measure(dict_waterfall):
+            instrument.set(0)
+            return [axis]+[trace]*ncolumns
+    return measure, instrument
+
+
+def make_sweeps(depth, npoints, latency):
+    # depth nested sweeps with together about npoints points, the innermost sweep first
+    per_sweep = max(int(round(npoints**(1/depth))), 1)
+    parameters = [FakeParameter('p'+str(i), latency) for i in range(depth)]
+    sweepobjects = [pysweep.sweep_object(p, np.linspace(0, 1, per_sweep)) for p in parameters]
+    return sweepobjects, parameters, per_sweep**depth
+
+
+def list_backend(workdir):
+    from pysweep.databackends.list_backend import ListDataBackend
+    return ListDataBackend()
+
+
+def debug_backend(workdir):
+    from pysweep.databackends.debug import DebugDataBackend
+    return DebugDataBackend()
+
+
+def spyview_backend(workdir):
+    import qcodes as qc
+    import pysweep.databackends.spyview as spyview
+    if not hasattr(pysweep, 'STATION'):
+        pysweep.STATION = qc.Station()
+    spyview.fmt = os.path.join(workdir, 'spyview', '{date}_{counter}')
+    return spyview.DataBackend()
+
+
+def qcodes_backend(workdir):
+    import qcodes as qc
+    import pysweep.databackends.qcodes as qcodes_databackend
+    from qcodes.dataset.measurements import Measurement
+    qc.initialise_or_create_database_at(os.path.join(workdir, 'benchmark.db'))
+    experiment = qc.load_or_create_experiment('benchmark', sample_name='pysweep')
+    return qcodes_databackend.DataBackend(Measurement(experiment, qc.Station()))
+
+
+def memmap_backend(workdir):
+    from pysweep.databackends.memmap import MemmapDataBackend
+    return MemmapDataBackend(os.path.join(workdir, 'memmap'))
+
+
+def memmap_compressed_backend(workdir):
+    # the array columns are compressed, which shows the cost of the codec per point
+    from pysweep.databackends.memmap import MemmapDataBackend
+    return MemmapDataBackend(os.path.join(workdir, 'memmap'), compress=True)
+
+
+def combined_backend(workdir):
+    # two in-memory children, such that the overhead of CombinedDataBackend itself is measured
+    from pysweep.databackends.base import CombinedDataBackend
+    return CombinedDataBackend([list_backend(workdir), list_backend(workdir)])
+
+
+def combined_threaded_backend(workdir):
+    # the same children, each with its own writer thread
+    from pysweep.databackends.base import CombinedDataBackend
+    return CombinedDataBackend([list_backend(workdir), list_backend(workdir)], threaded=True)
+
+
+BACKENDS = {'list': list_backend,
+            'debug': debug_backend,
+            'spyview': spyview_backend,
+            'qcodes': qcodes_backend,
+            'memmap': memmap_backend,
+            'memmap_z': memmap_compressed_backend,
+            'combined': combined_backend,
+            'combined_threaded': combined_threaded_backend}
+
+
+def run_case(backend, depth, ncolumns, array_points, npoints, latency, repeat, workdir):
+    '''
+    Time one case
+
+    :return: dict with the number of points and the best and median overhead per point in microseconds
+    '''
+    overheads = []
+    for _ in range(repeat):
+        sweepobjects, parameters, total = make_sweeps(depth, npoints, latency)
+        measure, instrument = make_measure(ncolumns, latency, array_points)
+        databackend = BACKENDS[backend](workdir)
+        # the debug backend prints every point, which should not end up in the benchmark output
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            pysweep.sweep(lambda d: None, lambda d: None, measure, *sweepobjects, databackend=databackend)
+            elapsed = time.perf_counter() - start
+        busy = instrument.busy + sum(p.busy for p in parameters)
+        overheads.append((elapsed - busy)/total)
+    return {'points': total,
+            'best_us': 1e6*min(overheads),
+            'median_us': 1e6*float(np.median(overheads))}
+
+
+def cases(args):
+    # every axis of the benchmark is varied separately around a base case
+    base = {'depth': 2, 'ncolumns': 1, 'array_points': None}
+    yield base
+    for depth in args.depths:
+        if depth != base['depth']:
+            yield dict(base, depth=depth)
+    for ncolumns in args.columns:
+        if ncolumns != base['ncolumns']:
+            yield dict(base, ncolumns=ncolumns)
+    for ncolumns in args.columns:
+        yield dict(base, ncolumns=ncolumns, array_points=args.array_points)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the per-point overhead of pysweep.sweep()')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--points', type=int, default=1024, help='total number of points of every sweep')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 3, 4], help='numbers of nested sweeps')
+    parser.add_argument('--columns', type=int, nargs='+', default=[1, 10, 50], help='numbers of measured columns')
+    parser.add_argument('--array-points', type=int, default=100, help='length of the measured arrays')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every set and measurement takes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='json file to write the results to')
+    args = parser.parse_args(argv)
+
+    results = []
+    print('{:<10}{:>6}{:>9}{:>7}{:>8}{:>14}{:>14}'.format('backend', 'depth', 'columns', 'array', 'points',
+                                                         'best (us)', 'median (us)'))
+    for backend in args.backends:
+        for case in cases(args):
+            result = dict(case, backend=backend, latency=args.latency)
+            workdir = tempfile.mkdtemp(prefix='pysweep_benchmark_')
+            try:
+                result.update(run_case(backend, case['depth'], case['ncolumns'], case['array_points'], args.points,
+                                       args.latency, args.repeat, workdir))
+                timing = '{points:>8}{best_us:>14.1f}{median_us:>14.1f}'.format(**result)
+            except ImportError as e:
+                result['skipped'] = 'not available: '+str(e)
+                timing = '  '+result['skipped']
+            except Exception as e:
+                result['skipped'] = type(e).__name__+': '+str(e)
+                timing = '  '+result['skipped']
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            results.append(result)
+            print('{:<10}{:>6}{:>9}{:>7}'.format(backend, case['depth'], case['ncolumns'],
+                                                  'yes' if case['array_points'] else 'no')+timing)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'commit': git_commit(),
+                       'python': sys.version,
+                       'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'settings': vars(args),
+                       'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,136 +1,157 @@
-import time
-from IPython.display import clear_output
+import os
+import numpy as np
+
 from pysweep.databackends.base import DataParameter, DataParameterFixedSweep
-from pysweep.core.sweepobject import SweepObject
+from pysweep.core.sweepobject import SweepObject, HardwareSweepObject, SetpointCache
+from pysweep.core.sweepengine import SweepEngine, read_checkpoint
+from pysweep.core.profiling import SweepProfile
+from pysweep.core.sampler import ParameterSampler
 from pysweep.core.measurementfunctions import MeasurementFunction, MakeMeasurementFunction
 
 # define sweep_object
-def sweep_object(parameter, points, dataparameter=None):
+def sweep_object(parameter, points, dataparameter=None, setpoint_cache=None, serpentine=False):
+    '''
+    Sweep a qcodes parameter over a list of points
+
+    :param parameter: the parameter to set
+    :param points: list of points, or a MeasurementFunction that returns the points
+    :param dataparameter: see SweepObject
+    :param setpoint_cache: True or a SetpointCache to skip sets of the value that was applied last. A SetpointCache
+        can be shared between sweep objects of the same parameter, skipped sets are counted in SetpointCache.skipped
+    :param serpentine: sweep the points in reverse order on every other pass, see SweepObject
+    '''
+    if setpoint_cache is True:
+        setpoint_cache = SetpointCache()
+
+    if setpoint_cache is None:
+        @MakeMeasurementFunction([])
+        def fun(x, p):
+            parameter.set(x)
+            return []
+    else:
+        @MakeMeasurementFunction([])
+        def fun(x, p):
+            if setpoint_cache.is_set(x):
+                setpoint_cache.skipped += 1
+                return []
+            parameter.set(x)
+            setpoint_cache.update(x)
+            setpoint_cache.applied += 1
+            return []
+
+    @MakeMeasurementFunction([], points=points)
+    def point_fun(dict_waterfall):
+        return points, []
+
+    if isinstance(points, MeasurementFunction):
+        point_fun = points
+
+    return SweepObject(fun, parameter.unit, parameter.name, point_fun, dataparameter=dataparameter,
+                       setpoint_cache=setpoint_cache, serpentine=serpentine)
+
+def hardware_sweep_object(parameter, points, dataparameter=None, serpentine=False):
+    '''
+    Sweep an instrument over a list of points that it runs by itself, see HardwareSweepObject
+
+    The measurement function of the sweep is called once per pass and has to return, for every column, an array with
+    one value per point.
+
+    :param parameter: the parameter that takes the array of all points, for example the ramp of an AWG
+    :param points: list of points, or a MeasurementFunction that returns the points
+    :param dataparameter: see SweepObject
+    :param serpentine: sweep the points in reverse order on every other pass, see SweepObject
+    '''
     @MakeMeasurementFunction([])
-    def fun(x, p):
-        parameter.set(x)
+    def fun(points, p):
+        parameter.set(np.asarray(points))
         return []
 
-    @MakeMeasurementFunction([])
+    @MakeMeasurementFunction([], points=points)
     def point_fun(dict_waterfall):
         return points, []
 
     if isinstance(points, MeasurementFunction):
         point_fun = points
 
-    return SweepObject(fun, parameter.unit, parameter.name, point_fun, dataparameter=dataparameter)
+    return HardwareSweepObject(fun, parameter.unit, parameter.name, point_fun, dataparameter=dataparameter,
+                               serpentine=serpentine)
 
 def none(id):
     @MakeMeasurementFunction([])
     def fun(v, parameters):
         return []
 
-    @MakeMeasurementFunction([])
+    @MakeMeasurementFunction([], points=[1])
     def point_fun(dict_waterfall):
         return [1], []
 
-    return SweepObject(fun, 'e', 'None'+str(id), point_fun)
-
-def sweep(measurement_init, measurement_end, measure,
-          sweep1=none(1),
-          sweep2=none(2),
-          sweep3=none(3), databackend=None):
+    so = SweepObject(fun, 'e', 'None'+str(id), point_fun)
+    so.dummy = True
+    return so
+
+def sweep(measurement_init, measurement_end, measure, *sweepobjects, databackend=None, profile=None,
+          checkpoint=None, resume=False, sampler=None):
+    '''
+    Measure over any number of nested sweeps
+
+    :param measurement_init: function called with dict_waterfall before the measurement starts
+    :param measurement_end: function called with dict_waterfall after the measurement finished
+    :param measure: MeasurementFunction executed at every point of the innermost sweep.
+        For backwards compatibility this can also be a list [measure, sweep1, sweep2, ...]
+    :param sweepobjects: SweepObjects, the innermost sweep first
+    :param databackend: DataBackend that stores the data
+    :param profile: True or a SweepProfile to time every stage of the sweep per axis. The SweepProfile is
+        available as the profile attribute of the returned DataSaver, a SweepProfile can carry hooks for
+        external profilers
+    :param checkpoint: filename of a checkpoint that is written after every pass of the innermost sweep, with the
+        positions and points of the sweeps and the write position of the databackend. The databackend has to be
+        able to resume a measurement (see DataBackend.can_resume), which is checked before the measurement starts
+    :param resume: continue the measurement of the checkpoint after the last pass that was completed, writing to
+        the same data file when the databackend supports that. When the checkpoint does not exist yet, the
+        measurement starts from the beginning
+    :param sampler: a ParameterSampler, or a list of parameters, that are read in the background every pass of the
+        innermost sweep to follow drifts during the measurement, see ParameterSampler
+    :return: the DataSaver of the databackend
+    '''
     if not callable(measure):
-        slist = [*measure, sweep1, sweep2, sweep3]
-        for s in slist[4:]:
-            if not s['label'].startswith('None'):
-                raise Exception('Two many sweepers')
-        measure, sweep1, sweep2, sweep3 = slist[0:4]
-    class timer():
-        def __init__(self, npoints):
-            # save the starting time upon instantiating this class
-            self.starttime = time.time()
-            self.lastprint = time.time()
-            self.npoints = npoints
-            self.point = 0
-
-        def update(self, delta):
-            # update the amount of points that have been measured
-            self.point += delta
-            # if more than a minute has passed since the previous update,
-            # check for user interrupts and print expected
-            # time of completion
-            if time.time() - self.lastprint > 60:
-                self.lastprint = time.time()
-                self.output(self.starttime + self.npoints * (
-                time.time() - self.starttime) / self.point)
-            return "0"
-
-        def output(self, eta):
-            # function for printing from the timer,
-            # here code could be added to send this information to
-            # anything that is interested
-            clear_output()
-            print(time.asctime(time.localtime(eta)))
+        sweepobjects = (*measure[1:], *sweepobjects)
+        measure = measure[0]
 
     dict_waterfall = {'STATUS': 'INIT'}
 
-
-    #TODO create datafile here
-    n = 1
-    if isinstance(sweep1.get_dataparameter(), DataParameterFixedSweep):
-        n = n*sweep1.get_dataparameter().npoints
-    if isinstance(sweep2.get_dataparameter(), DataParameterFixedSweep):
-        n = n*sweep2.get_dataparameter().npoints
-    if isinstance(sweep3.get_dataparameter(), DataParameterFixedSweep):
-        n = n*sweep3.get_dataparameter().npoints
-    t = timer(n)
-    #def so2c(so):
-    #    points, _ = so.point_function(dict_waterfall)
-    #    return DataParameterFixedSweep(so.label, so.unit, 'numeric', points[0], points[-1], len(points))
-    cols = []
-
-    for param in sweep3.point_function.get_paramstruct():
-        cols.append(param)
-    cols.append(sweep3.get_dataparameter())
-    for param in sweep3.set_function.get_paramstruct():
-        cols.append(param)
-
-    for param in sweep2.point_function.get_paramstruct():
-        cols.append(param)
-    cols.append(sweep2.get_dataparameter())
-    for param in sweep2.set_function.get_paramstruct():
-        cols.append(param)
-
-    for param in sweep1.point_function.get_paramstruct():
-        cols.append(param)
-    cols.append(sweep1.get_dataparameter())
-    for param in sweep1.set_function.get_paramstruct():
-        cols.append(param)
-
-    for param in measure.get_paramstruct():
-        cols.append(param)
-
-    databackend.setup(cols, dict_waterfall)
+    if profile is True:
+        profile = SweepProfile()
+    if sampler is not None and not isinstance(sampler, ParameterSampler):
+        sampler = ParameterSampler(sampler)
+
+    if checkpoint is not None and not databackend.can_resume():
+        raise ValueError(databackend.__class__.__name__+' can not resume a measurement, so a checkpoint '
+                         'could not be resumed')
+
+    engine = SweepEngine(measure, sweepobjects, profile=profile, checkpoint=checkpoint, sampler=sampler)
+    layout = engine.compile(dict_waterfall)
+    state = None
+    if resume:
+        if checkpoint is None:
+            raise ValueError('A measurement can only be resumed from a checkpoint')
+        if os.path.exists(checkpoint):
+            state = read_checkpoint(checkpoint)
+            if not engine.resume_from(state):
+                raise ValueError('The measurement of checkpoint '+str(checkpoint)+' is already complete')
+    databackend.setup(layout.params, dict_waterfall)
+    if state is not None:
+        databackend.resume(state['backend'])
     measurement_init(dict_waterfall)
-    colnames = [col.name for col in cols]
 
     with databackend as pysweep_datasaver:
         # do measurement
         dict_waterfall.update({'STATUS': 'RUN'})
-        dict_waterfall.update({'DATASET': pysweep_datasaver.datasaver._dataset})
-        points3, s3p_measure = sweep3.point_function(dict_waterfall)
-        for s3 in points3:
-            s3_measure = sweep3.set_function(s3, dict_waterfall)
-            points2, s2p_measure = sweep2.point_function(dict_waterfall)
-            for s2 in points2:
-                s2_measure = sweep2.set_function(s2, dict_waterfall)
-                points1, s1p_measure = sweep1.point_function(dict_waterfall)
-                for s1 in points1:
-                    s1_measure = sweep1.set_function(s1, dict_waterfall)
-
-                    data = s3p_measure + [s3] + s3_measure + s2p_measure + [s2] + s2_measure + s1p_measure + [s1] + s1_measure + measure(dict_waterfall)
-                    pysweep_datasaver.add_to_line(list(zip(colnames, data)))
-                    pysweep_datasaver.write_line()
-                    t.update(1)
-                pysweep_datasaver.write_block()
+        if hasattr(pysweep_datasaver, 'datasaver'):
+            dict_waterfall.update({'DATASET': pysweep_datasaver.datasaver._dataset})
+        if profile is not None:
+            pysweep_datasaver.profile = profile
+        engine.run(pysweep_datasaver, dict_waterfall)
         dict_waterfall.update({'STATUS': 'STOP'})
         measurement_end(dict_waterfall)
-    
-    return pysweep_datasaver
 
+    return pysweep_datasaver
@@ -10,7 +10,9 @@ def add_function(sweep_object, fun):
         r = sweep_object.set_function(x, dict_waterfall)
         r2 = fun(dict_waterfall)
         return r+r2
-    return SweepObject(wrapper, sweep_object.unit, sweep_object.label, sweep_object.point_function)
+    # keep the kind of sweep object, for a hardware sweep fun is called once per pass as well
+    return sweep_object.__class__(wrapper, sweep_object.unit, sweep_object.label, sweep_object.point_function,
+                                  setpoint_cache=sweep_object.setpoint_cache, serpentine=sweep_object.serpentine)
 
 
 def sweep_repetitions(waiting_time, npoints):
@@ -19,7 +21,7 @@ def sweep_repetitions(waiting_time, npoints):
         time.sleep(waiting_time)
         return []
 
-    @MakeMeasurementFunction([])
+    @MakeMeasurementFunction([], points=range(npoints))
     def point_fun(dict_waterfall):
         return range(npoints), []
     return SweepObject(fun, '', 'iteration', point_fun)
@@ -0,0 +1,238 @@
+from bisect import bisect
+import numpy as np
+
+from pysweep.core.sweepobject import SweepObject
+from pysweep.core.measurementfunctions import MakeMeasurementFunction
+from pysweep.databackends.base import DataParameter
+
+'''
+Sweep objects that choose their points while measuring.
+They start with a coarse grid and then add points where the measured signal changes fastest,
+until a point budget or a resolution is reached.
+Because the points are not known in advance, backends see a plain (non-gridded) DataParameter.
+'''
+
+
+def _scaled(values):
+    # rescale values to [0, 1], such that losses of x and signal can be compared
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    span = values.max() - values.min()
+    if span == 0:
+        return values*0
+    return (values - values.min())/span
+
+
+class AdaptiveSampler1D:
+    def __init__(self, start, stop, initial_points, max_points, resolution=0, loss='gradient'):
+        '''
+        Chooses the points of a 1D sweep. Iterate over points() and tell() the signal of every point before asking
+        for the next one.
+
+        :param start: first point of the sweep
+        :param stop: last point of the sweep
+        :param initial_points: number of points of the coarse grid that is measured first
+        :param max_points: total number of points to measure
+        :param resolution: intervals smaller than twice this value are not split any further
+        :param loss: 'gradient' splits the intervals where the signal changes most,
+            'curvature' splits the intervals where the signal deviates most from a straight line
+        '''
+        if loss not in ('gradient', 'curvature'):
+            raise ValueError('loss should be \'gradient\' or \'curvature\', not '+repr(loss))
+        self.start = start
+        self.stop = stop
+        self.initial_points = initial_points
+        self.max_points = max_points
+        self.resolution = resolution
+        self.loss = loss
+        self.xs = []  # measured points, sorted
+        self.ys = []  # signal of the measured points
+
+    def tell(self, x, y):
+        i = bisect(self.xs, x)
+        self.xs.insert(i, x)
+        self.ys.insert(i, y)
+
+    def points(self):
+        for x in np.linspace(self.start, self.stop, self.initial_points):
+            yield x
+        while len(self.xs) < self.max_points:
+            x = self.next_point()
+            if x is None:
+                return
+            yield x
+
+    def losses(self) -> np.ndarray:
+        xs = _scaled(self.xs)
+        ys = _scaled(self.ys)
+        dx = np.diff(xs)
+        dy = np.diff(ys)
+        losses = np.hypot(dx, dy)
+        if self.loss == 'curvature' and len(xs) > 2:
+            # area of the triangles spanned by three neighbouring points, which is zero on a straight line
+            areas = 0.5*np.abs(dx[:-1]*dy[1:] - dx[1:]*dy[:-1])
+            curvature = np.zeros(len(dx))
+            curvature[:-1] = areas
+            curvature[1:] = np.maximum(curvature[1:], areas)
+            # the small length term keeps straight parts from being ignored forever
+            losses = np.sqrt(curvature) + 0.1*losses
+        # do not split intervals below the resolution
+        losses[np.abs(np.diff(self.xs)) < 2*self.resolution] = -1
+        return losses
+
+    def next_point(self):
+        if len(self.xs) < 2:
+            return None
+        losses = self.losses()
+        i = int(np.argmax(losses))
+        if losses[i] < 0:
+            return None
+        return (self.xs[i] + self.xs[i+1])/2
+
+
+class AdaptiveSampler2D:
+    def __init__(self, x_range, y_range, initial_points, max_points, resolution=(0, 0)):
+        '''
+        Chooses the points of a 2D sweep by splitting the rectangular cells whose corners differ most in signal
+        into four smaller cells. Iterate over points() and tell() the signal of every point before asking for
+        the next one.
+
+        :param x_range: (start, stop) of the first parameter
+        :param y_range: (start, stop) of the second parameter
+        :param initial_points: (nx, ny) size of the coarse grid that is measured first
+        :param max_points: total number of points to measure
+        :param resolution: (dx, dy) cells smaller than twice this size are not split any further
+        '''
+        self.x_range = x_range
+        self.y_range = y_range
+        self.initial_points = initial_points
+        self.max_points = max_points
+        self.resolution = resolution
+        self.values = {}  # (x, y) -> signal
+        self.cells = []  # (x0, x1, y0, y1) of all cells that are not split
+
+    def tell(self, point, value):
+        self.values[tuple(point)] = value
+
+    def points(self):
+        xs = np.linspace(*self.x_range, self.initial_points[0])
+        ys = np.linspace(*self.y_range, self.initial_points[1])
+        for y in ys:
+            for x in xs:
+                yield (x, y)
+        self.cells = [(xs[i], xs[i+1], ys[j], ys[j+1]) for i in range(len(xs)-1) for j in range(len(ys)-1)]
+
+        while len(self.values) < self.max_points:
+            cell = self.next_cell()
+            if cell is None:
+                return
+            x0, x1, y0, y1 = cell
+            xm = (x0 + x1)/2
+            ym = (y0 + y1)/2
+            self.cells.remove(cell)
+            self.cells += [(x0, xm, y0, ym), (xm, x1, y0, ym), (x0, xm, ym, y1), (xm, x1, ym, y1)]
+            for point in [(xm, ym), (xm, y0), (xm, y1), (x0, ym), (x1, ym)]:
+                if point not in self.values and len(self.values) < self.max_points:
+                    yield point
+
+    def next_cell(self):
+        values = np.nan_to_num(np.array(list(self.values.values()), dtype=float))
+        span = (values.max() - values.min()) or 1
+        width = abs(self.x_range[1] - self.x_range[0]) or 1
+        height = abs(self.y_range[1] - self.y_range[0]) or 1
+
+        best, best_loss = None, -1
+        for cell in self.cells:
+            x0, x1, y0, y1 = cell
+            if abs(x1 - x0) < 2*self.resolution[0] or abs(y1 - y0) < 2*self.resolution[1]:
+                continue
+            corners = np.nan_to_num([self.values[(x, y)] for x in (x0, x1) for y in (y0, y1)])
+            # signal variation within the cell, weighted with the cell size.
+            # the small constant keeps flat cells from being ignored forever
+            loss = np.sqrt(abs(x1 - x0)/width*abs(y1 - y0)/height)*((corners.max() - corners.min())/span + 0.1)
+            if loss > best_loss:
+                best, best_loss = cell, loss
+        return best
+
+
+def adaptive_sweep_object(parameter, start, stop, signal, initial_points=11, max_points=101, resolution=0,
+                          loss='gradient'):
+    '''
+    Sweep a qcodes parameter from start to stop, refining where the signal changes fastest
+
+    :param parameter: the parameter to set
+    :param start: first point of the sweep
+    :param stop: last point of the sweep
+    :param signal: MeasurementFunction that is executed after every set, the first value it returns steers the
+        refinement. Its values are stored as columns of this sweep
+    :param initial_points: see AdaptiveSampler1D
+    :param max_points: see AdaptiveSampler1D
+    :param resolution: see AdaptiveSampler1D
+    :param loss: see AdaptiveSampler1D
+    '''
+    # the sampler of the pass that is currently running
+    state = {'sampler': None}
+
+    @MakeMeasurementFunction(signal.get_paramstruct())
+    def fun(x, dict_waterfall):
+        parameter.set(x)
+        r = signal(dict_waterfall)
+        state['sampler'].tell(x, r[0])
+        return r
+
+    @MakeMeasurementFunction([])
+    def point_fun(dict_waterfall):
+        state['sampler'] = AdaptiveSampler1D(start, stop, initial_points, max_points, resolution, loss)
+        return state['sampler'].points(), []
+
+    dataparameter = DataParameter(parameter.name, parameter.unit, 'numeric', independent=True)
+    return SweepObject(fun, parameter.unit, parameter.name, point_fun, dataparameter=dataparameter)
+
+
+def adaptive_sweep_object_2d(parameter_x, parameter_y, x_range, y_range, signal, initial_points=(11, 11),
+                             max_points=1001, resolution=(0, 0)):
+    '''
+    Sweep two qcodes parameters over a rectangle, refining where the signal changes fastest
+
+    The value of this sweep object is the number of the point, it is stored as an independent that the other columns
+    do not depend on. The values of both parameters are stored as independents by the set function, followed by the
+    values of the signal.
+
+    :param parameter_x: the first parameter to set
+    :param parameter_y: the second parameter to set
+    :param x_range: (start, stop) of the first parameter
+    :param y_range: (start, stop) of the second parameter
+    :param signal: MeasurementFunction that is executed after every set, the first value it returns steers the
+        refinement
+    :param initial_points: see AdaptiveSampler2D
+    :param max_points: see AdaptiveSampler2D
+    :param resolution: see AdaptiveSampler2D
+    '''
+    state = {'sampler': None, 'points': None}
+    label = parameter_x.name+'_'+parameter_y.name+'_point'
+
+    paramstruct = [DataParameter(parameter_x.name, parameter_x.unit, 'numeric', independent=True),
+                   DataParameter(parameter_y.name, parameter_y.unit, 'numeric', independent=True)]
+
+    @MakeMeasurementFunction(paramstruct+signal.get_paramstruct())
+    def fun(n, dict_waterfall):
+        x, y = state['points'][n]
+        parameter_x.set(x)
+        parameter_y.set(y)
+        r = signal(dict_waterfall)
+        state['sampler'].tell((x, y), r[0])
+        return [x, y]+r
+
+    def numbered_points(sampler):
+        # the points are handed to the set function by their number
+        for n, point in enumerate(sampler.points()):
+            state['points'].append(point)
+            yield n
+
+    @MakeMeasurementFunction([])
+    def point_fun(dict_waterfall):
+        state['sampler'] = AdaptiveSampler2D(x_range, y_range, initial_points, max_points, resolution)
+        state['points'] = []
+        return numbered_points(state['sampler']), []
+
+    dataparameter = DataParameter(label, '', 'numeric', independent=2)
+    return SweepObject(fun, '', label, point_fun, dataparameter=dataparameter)
@@ -1,4 +1,5 @@
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 
 from pysweep.databackends.base import DataParameter
 
@@ -7,9 +8,16 @@ paramstructure / paramstruct is a list of the DataParameters
 '''
 
 class MeasurementFunction:
-    def __init__(self, function, paramstruct):
+    def __init__(self, function, paramstruct, points=None):
         self.function = function
         self.paramstruct = paramstruct
+        # a point function can declare (a mock version of) the points it returns, such that a SweepObject
+        # does not have to execute it before the sweep to learn the shape of the sweep
+        self.points = points
+        # the functions that run at the same time when this function is called, see __or__
+        self.concurrent_functions = [function]
+        self.executor = None  # the threads of a function combined with |, started at its first call
+        self.parts = []  # the functions this one is combined from with + or |, which shutdown also stops
 
     def __call__(self, *args, **kwargs) -> list:
         return self.function(*args, **kwargs)
@@ -21,7 +29,42 @@ class MeasurementFunction:
 
         combined_paramstruct = self.paramstruct+other.paramstruct
 
-        return MeasurementFunction(combined_function, combined_paramstruct)
+        combined = MeasurementFunction(combined_function, combined_paramstruct)
+        combined.parts = [self, other]
+        return combined
+
+    # measure_a | measure_b combines two measurement functions like measure_a + measure_b, but executes them
+    # concurrently, each in its own thread. This is useful for instruments that are read out over separate
+    # connections, the time per point becomes that of the slowest instrument instead of the sum of all of them.
+    # The values are still returned in the order of the paramstruct.
+    # Note that the functions share the dict_waterfall, so they should not modify it
+    # The threads are only started when the combined function is called, such that a | b | c starts a single set of
+    # threads, and they are stopped by shutdown, which the SweepEngine calls at the end of every sweep
+    def __or__(self, other):
+        functions = self.concurrent_functions + other.concurrent_functions
+
+        def concurrent_function(*args, **kwargs):
+            if combined_function.executor is None:
+                combined_function.executor = ThreadPoolExecutor(max_workers=len(functions))
+            futures = [combined_function.executor.submit(function, *args, **kwargs) for function in functions]
+            r = []
+            for future in futures:
+                r += future.result()
+            return r
+
+        combined_function = MeasurementFunction(concurrent_function, self.paramstruct+other.paramstruct)
+        combined_function.concurrent_functions = functions
+        combined_function.parts = [self, other]
+        return combined_function
+
+    # Stop the threads of a function combined with |, also those of the functions it is combined from, such as
+    # (a | b) + c. They are started again when the function is called again
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for part in self.parts:
+            part.shutdown()
 
 
     # The paramstruct method should return a list of DataParameters for each element this
@@ -43,7 +86,9 @@ class MeasurementFunction:
 # the initialization parameters od DataParameter
 # The order in this list corresponds to the order of parameters returned
 # by the measurement function.
-def MakeMeasurementFunction(paramstruct):
+# Point functions can pass points, a list with (a mock version of) the points they return, or a DataParameter
+# describing them, see SweepObject
+def MakeMeasurementFunction(paramstruct, points=None):
     new_param_struct = []
     for param in paramstruct:
         if isinstance(param, DataParameter):
@@ -52,5 +97,5 @@ def MakeMeasurementFunction(paramstruct):
             new_param_struct.append(DataParameter(*param))
 
     def decorator(function):
-        return MeasurementFunction(function, new_param_struct)
+        return MeasurementFunction(function, new_param_struct, points=points)
     return decorator
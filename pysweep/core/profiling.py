@@ -0,0 +1,108 @@
+import time
+import numpy as np
+
+'''
+Timing of the stages of the sweep loop. Every call of a point_function, set_function, the measurement and the
+DataSaver (add_row, write_line, write_block) is timed and recorded per sweep axis, such that a slow sweep can be
+attributed to the instruments, the backend or pysweep itself.
+'''
+
+STAGES = ['point_function', 'set_function', 'measure', 'add_row', 'write_line', 'write_block']
+
+
+class SweepProfile:
+    def __init__(self, hooks=()):
+        '''
+        Collects the duration of every stage of a sweep
+
+        The durations are stored per (stage, axis), where axis is the label of the sweep object the stage belongs to.
+        The measurement and the add_row and write_line calls that follow it have the axis 'measure'.
+
+        :param hooks: callables that are called as hook(stage, axis, duration) after every timed call, for example
+            to forward the timings to an external profiler
+        '''
+        self.durations = {}  # (stage, axis) -> list of durations in seconds
+        self.hooks = list(hooks)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        self.durations = {}
+
+    def timed(self, function, stage, axis):
+        '''
+        Wrap function such that the duration of every call is recorded
+
+        :param function: the function to time
+        :param stage: the stage of the sweep loop, one of STAGES
+        :param axis: the label of the sweep axis, or 'measure'
+        :return: a function with the same arguments and return value as function
+        '''
+        durations = self.durations.setdefault((stage, axis), [])
+        hooks = self.hooks
+        clock = time.perf_counter
+
+        def timed_function(*args):
+            start = clock()
+            r = function(*args)
+            duration = clock() - start
+            durations.append(duration)
+            for hook in hooks:
+                hook(stage, axis, duration)
+            return r
+        return timed_function
+
+    def get_durations(self, stage, axis=None) -> np.ndarray:
+        # the durations of a stage, of all axes together when axis is None
+        if axis is not None:
+            return np.array(self.durations.get((stage, axis), []))
+        durations = [d for (s, a), d in self.durations.items() if s == stage]
+        return np.concatenate([np.array([])]+[np.array(d) for d in durations])
+
+    def histogram(self, stage, axis=None, bins=20):
+        '''
+        Histogram of the durations of a stage, with logarithmically spaced bins
+
+        :param stage: the stage of the sweep loop
+        :param axis: the label of the sweep axis, None combines all axes
+        :param bins: number of bins
+        :return: counts and bin edges in seconds, like numpy.histogram
+        '''
+        durations = self.get_durations(stage, axis)
+        durations = durations[durations > 0]
+        if not len(durations):
+            return np.zeros(bins, dtype=int), np.zeros(bins+1)
+        low, high = durations.min(), durations.max()
+        if low == high:
+            high = low*1.001
+        return np.histogram(durations, bins=np.geomspace(low, high, bins+1))
+
+    def summary(self) -> dict:
+        '''
+        :return: for every (stage, axis) a dict with the number of calls and the total, mean, median,
+            95th percentile and maximum duration in seconds
+        '''
+        summary = {}
+        for key in sorted(self.durations, key=lambda key: (STAGES.index(key[0]), str(key[1]))):
+            durations = np.array(self.durations[key])
+            if not len(durations):
+                continue
+            summary[key] = {'calls': len(durations),
+                            'total': durations.sum(),
+                            'mean': durations.mean(),
+                            'median': np.median(durations),
+                            'p95': np.percentile(durations, 95),
+                            'max': durations.max()}
+        return summary
+
+    def __repr__(self):
+        lines = ['{:<15}{:<20}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('stage', 'axis', 'calls', 'total (s)',
+                                                                 'mean (ms)', 'p95 (ms)', 'max (ms)')]
+        for (stage, axis), s in self.summary().items():
+            lines.append('{:<15}{:<20}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+                stage, str(axis), s['calls'], s['total'], 1e3*s['mean'], 1e3*s['p95'], 1e3*s['max']))
+        return '\n'.join(lines)
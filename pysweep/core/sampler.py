@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+'''
+Sampling of parameters while a sweep runs, to follow drifts (temperatures, magnetic fields, offsets) during long
+measurements without adding columns to every point. The parameters are read in a background thread, either at a fixed
+interval or once after every pass of the innermost sweep, and every sample is tagged with the time, the number of
+measured points and the index of every outer sweep. The samples are appended to a small tab-separated file next to
+the data, which load_samples reads back.
+'''
+
+
+def load_samples(filename) -> dict:
+    '''
+    Read the samples written by a ParameterSampler, also while the measurement is still running
+
+    :param filename: the file the samples were written to
+    :return: dict with an array for every column: time, point (the number of measured points), <label>_index for
+        every outer sweep and the name of every parameter
+    '''
+    with open(filename) as f:
+        names = f.readline().lstrip('#').strip().split('\t')
+        data = np.loadtxt(f, delimiter='\t', ndmin=2)
+    if not len(data):
+        data = np.zeros((0, len(names)))
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+class ParameterSampler:
+    def __init__(self, parameters, interval=None, filename=None):
+        '''
+        Reads a set of parameters in a background thread while the measurement runs
+
+        The parameters are read from another thread than the one that sets the sweeps, only pass parameters whose
+        instruments can be used from two threads, or that are not used by the sweeps and the measurement.
+
+        :param parameters: the (qcodes) parameters to sample, anything with a name and a get method
+        :param interval: seconds between two samples. When None (default), a sample is taken after every pass of
+            the innermost sweep
+        :param filename: the file to write the samples to. When None, the file is placed next to the data, see
+            DataSaver.samples_filename. When the DataSaver has no such file the samples are only kept in memory,
+            in the samples attribute
+        '''
+        self.parameters = list(parameters)
+        self.interval = interval
+        self.filename = filename
+        self.names = None
+        self.samples = []  # the samples of the last measurement, as lists of values in the order of names
+        self.errors = 0  # number of parameter reads that failed, these are stored as NaN
+        self.error = None  # the last exception of a failed read
+        self.engine = None
+        self.file = None
+        self.triggers = None
+        self.stopped = None
+        self.thread = None
+
+    def start(self, engine, datasaver, append=False):
+        '''
+        Start sampling, called by the SweepEngine when the measurement starts
+
+        :param engine: the SweepEngine that runs the measurement, its positions tag the samples
+        :param datasaver: the DataSaver of the measurement, which tells where to store the samples
+        :param append: add the samples to an existing file, for a measurement that is resumed
+        '''
+        self.engine = engine
+        self.names = (['time', 'point']+[str(so.label)+'_index' for so in reversed(engine.sweepobjects[1:])]+
+                      [p.name for p in self.parameters])
+        self.samples = []
+        self.errors = 0
+        self.error = None
+        filename = self.filename if self.filename is not None else datasaver.samples_filename()
+        self.file = None
+        if filename is not None:
+            # a resumed measurement continues the file of the checkpoint, when the DataBackend wrote one
+            if append and os.path.exists(filename):
+                self.file = open(filename, 'a')
+            else:
+                self.file = open(filename, 'w')
+                self.file.write('# '+'\t'.join(self.names)+'\n')
+                self.file.flush()
+        self.triggers = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._work, name='pysweep sampler', daemon=True)
+        self.thread.start()
+
+    def trigger(self):
+        # called by the engine after every pass of the innermost sweep. The position is taken here, in the
+        # measurement thread, but the parameters are read by the sampler thread
+        if self.interval is None:
+            self.triggers.put(self._position())
+
+    def stop(self):
+        # wait for the samples that were triggered, and close the file
+        self.stopped.set()
+        self.triggers.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _position(self):
+        # the number of measured points and the index of every outer sweep, outermost first
+        engine = self.engine
+        return [time.time(), engine.timer.point]+engine.position[:0:-1]
+
+    def _work(self):
+        while True:
+            if self.interval is None:
+                position = self.triggers.get()
+                if position is None:
+                    return
+            else:
+                if self.stopped.wait(self.interval):
+                    return
+                position = self._position()
+            self._sample(position)
+
+    def _sample(self, position):
+        values = []
+        for parameter in self.parameters:
+            try:
+                values.append(float(parameter.get()))
+            except Exception as e:
+                self.errors += 1
+                self.error = e
+                values.append(np.nan)
+        sample = position+values
+        self.samples.append(sample)
+        if self.file is not None:
+            self.file.write('\t'.join(repr(float(v)) for v in sample)+'\n')
+            self.file.flush()
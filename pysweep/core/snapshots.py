@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+import qcodes as qc
+
+'''
+A cache for station snapshots. Taking a snapshot of a large station queries every instrument, which can take many
+seconds and is repeated for every sweep. The SnapshotCache keeps the snapshot of every component of the station for a
+configurable time (ttl), can take the snapshot in a worker thread while the measurement starts, and can store a
+snapshot as the difference with a previous one.
+'''
+
+# key of a stored snapshot that only holds the difference with another stored snapshot
+BASE_KEY = 'pysweep_snapshot_base'
+
+
+def snapshot_diff(old, new):
+    '''
+    The difference between two (nested) snapshots
+
+    :return: dict with 'changed', the entries of new that are not in old or have another value, nested like the
+        snapshot, and 'removed', the paths (lists of keys) of the entries of old that are not in new
+    '''
+    changed = {}
+    removed = []
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            diff = snapshot_diff(old[key], value)
+            if diff['changed']:
+                changed[key] = diff['changed']
+            removed += [[key]+path for path in diff['removed']]
+        elif not _equal(value, old[key]):
+            changed[key] = value
+    removed += [[key] for key in old if key not in new]
+    return {'changed': changed, 'removed': removed}
+
+
+def _equal(a, b):
+    try:
+        return bool(a == b)
+    except (ValueError, TypeError):
+        # for example arrays, which are stored again when in doubt
+        return False
+
+
+def apply_snapshot_diff(base, diff):
+    # the inverse of snapshot_diff: the new snapshot from the old snapshot and the difference
+    snapshot = _merge(base, diff['changed'])
+    for path in diff['removed']:
+        # copy the dicts along the path, such that base is not changed
+        entry = snapshot
+        for key in path[:-1]:
+            entry[key] = dict(entry[key])
+            entry = entry[key]
+        entry.pop(path[-1], None)
+    return snapshot
+
+
+def _merge(base, changed):
+    merged = dict(base)
+    for key, value in changed.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merged[key] = _merge(base[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_snapshot(filename):
+    '''
+    Read a snapshot that was written by SnapshotCache.write, also when only its difference with a base snapshot
+    was stored
+    '''
+    with open(filename) as f:
+        snapshot = json.load(f)
+    if BASE_KEY in snapshot:
+        base = load_snapshot(os.path.join(os.path.dirname(filename), snapshot[BASE_KEY]))
+        snapshot = apply_snapshot_diff(base, snapshot)
+    return snapshot
+
+
+class SnapshotCache:
+    def __init__(self, station, ttl=60, ttls=None, update=True):
+        '''
+        Takes station snapshots, reusing the snapshot of every component for ttl seconds
+
+        :param station: the qcodes station
+        :param ttl: seconds that the snapshot of a component is reused before it is taken again
+        :param ttls: dict with the ttl of specific components by name, for example {'fridge': 600, 'lockin': 0}
+        :param update: passed on to the snapshot of every component, when True the instruments are queried
+        '''
+        self.station = station
+        self.ttl = ttl
+        self.ttls = {} if ttls is None else ttls
+        self.update = update
+        self.entries = {}  # name -> (time, snapshot)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.result = None
+        self.error = None
+        self.base = None  # (filename, snapshot) of the last full snapshot that was written, see write
+
+    def invalidate(self, name=None):
+        # forget the snapshot of a component, or of all components, such that it is taken again
+        with self.lock:
+            if name is None:
+                self.entries = {}
+            else:
+                self.entries.pop(name, None)
+
+    def snapshot(self) -> dict:
+        # a snapshot in the format of Station.snapshot, only the expired components are taken again
+        with self.lock:
+            snapshot = {'instruments': {}, 'parameters': {}, 'components': {}}
+            for name, component in self.station.components.items():
+                entry = self.entries.get(name)
+                if entry is None or time.time() - entry[0] > self.ttls.get(name, self.ttl):
+                    entry = (time.time(), component.snapshot(update=self.update))
+                    self.entries[name] = entry
+                if isinstance(component, qc.Instrument):
+                    snapshot['instruments'][name] = entry[1]
+                elif isinstance(component, qc.Parameter):
+                    snapshot['parameters'][name] = entry[1]
+                else:
+                    snapshot['components'][name] = entry[1]
+            return snapshot
+
+    def start(self):
+        '''
+        Take the snapshot in a worker thread, get it with get_result. Note that the worker queries the instruments of
+        which the snapshot expired at the same time as the measurement thread sets the first setpoints, use ttls of 0
+        only for instruments whose drivers can be used from two threads
+        '''
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._work, name='pysweep snapshot', daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        try:
+            self.result = self.snapshot()
+        except BaseException as e:
+            self.error = e
+
+    def get_result(self) -> dict:
+        # the snapshot of the worker thread, or a new snapshot when no worker was started
+        if self.thread is None:
+            return self.snapshot()
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def write(self, filename, snapshot):
+        '''
+        Write a snapshot as json. The first snapshot is written in full, later snapshots only as the difference with
+        it, which load_snapshot resolves
+
+        :param filename: the json file to write
+        :param snapshot: the snapshot, as returned by snapshot or get_result
+        '''
+        if self.base is not None and os.path.exists(self.base[0]):
+            base_filename, base = self.base
+            stored = snapshot_diff(base, snapshot)
+            stored[BASE_KEY] = os.path.relpath(base_filename, os.path.dirname(os.path.abspath(filename)))
+        else:
+            stored = snapshot
+            self.base = (os.path.abspath(filename), snapshot)
+        with open(filename, 'w') as f:
+            json.dump(stored, f, indent=4)
+
+
+class CachedStation:
+    # stands in for a station where only a snapshot is needed, such as a qcodes measurement run
+    def __init__(self, station, snapshot):
+        self.station = station
+        self.components = station.components
+        self._snapshot = snapshot
+
+    def snapshot(self, update=False):
+        return self._snapshot
+
+    def __getattr__(self, name):
+        return getattr(self.station, name)
@@ -0,0 +1,315 @@
+import os
+import pickle
+import time
+from IPython.display import clear_output
+
+from pysweep.databackends.base import DataParameterFixedSweep, RowLayout
+
+
+class Timer:
+    def __init__(self, npoints):
+        # save the starting time upon instantiating this class
+        self.starttime = time.time()
+        self.lastprint = time.time()
+        self.npoints = npoints
+        self.point = 0
+
+    def update(self, delta):
+        # update the amount of points that have been measured
+        self.point += delta
+        # if more than a minute has passed since the previous update,
+        # check for user interrupts and print expected
+        # time of completion
+        if time.time() - self.lastprint > 60:
+            self.lastprint = time.time()
+            self.output(self.starttime + self.npoints * (
+            time.time() - self.starttime) / self.point)
+        return "0"
+
+    def output(self, eta):
+        # function for printing from the timer,
+        # here code could be added to send this information to
+        # anything that is interested
+        clear_output()
+        print(time.asctime(time.localtime(eta)))
+
+
+def write_checkpoint(path, state):
+    # write to a temporary file first, such that a crash while writing does not destroy the previous checkpoint
+    with open(path+'.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(path+'.tmp', path)
+
+
+def read_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class SweepEngine:
+    def __init__(self, measure, sweepobjects, profile=None, checkpoint=None, sampler=None):
+        '''
+        Runs a measurement over an arbitrary number of nested sweeps
+
+        :param measure: MeasurementFunction executed at every point of the innermost sweep
+        :param sweepobjects: list of SweepObjects, the innermost sweep first. Placeholder axes (see pysweep.none)
+            are dropped, they do not contribute any data
+        :param profile: a SweepProfile that records the duration of every stage of the loop, None to not time
+            anything
+        :param checkpoint: filename to write a checkpoint to after every pass of the innermost sweep, from which
+            the measurement can be resumed (see resume_from). None to not write checkpoints
+        :param sampler: a ParameterSampler that reads parameters in the background while the measurement runs,
+            tagged with the positions of the sweeps. None to not sample anything
+        '''
+        self.measure = measure
+        self.sweepobjects = [s for s in sweepobjects if s is not None and not s.dummy]
+        if any(so.hardware for so in self.sweepobjects[1:]):
+            raise ValueError('Only the innermost sweep can be a hardware sweep')
+        self.profile = profile
+        self.checkpoint = checkpoint
+        self.sampler = sampler
+        self.resume_levels = None  # level -> (points, index to continue at, point_function values)
+        self.resume_passes = None
+        self.resume_complete = False
+
+    def get_paramstruct(self, dict_waterfall=None) -> list:
+        # The columns are ordered from the outermost sweep to the innermost sweep, followed by the measurement
+        cols = []
+        for so in reversed(self.sweepobjects):
+            cols += so.point_function.get_paramstruct()
+            cols.append(so.get_dataparameter(dict_waterfall))
+            cols += so.set_function.get_paramstruct()
+        cols += self.measure.get_paramstruct()
+        return cols
+
+    def get_npoints(self) -> int:
+        # Number of innermost points, as far as it can be known in advance
+        n = 1
+        for so in self.sweepobjects:
+            if isinstance(so.get_dataparameter(), DataParameterFixedSweep):
+                n = n*so.get_dataparameter().npoints
+        return n
+
+    def compile(self, dict_waterfall=None) -> RowLayout:
+        '''
+        Determine once which slots of a row every sweep level and the measurement write to
+
+        :param dict_waterfall: passed to the point functions that have to be executed to resolve the
+            dataparameters of their sweeps
+        :return: the RowLayout of the rows that will be handed to the DataSaver
+        '''
+        for so in self.sweepobjects:
+            so.forget_dataparameter()
+        self.layout = RowLayout(self.get_paramstruct(dict_waterfall))
+        # per level: (slice of the point_function values, slot of the setpoint, slice of the set_function values)
+        self.slots = [None]*len(self.sweepobjects)
+        i = 0
+        for level in reversed(range(len(self.sweepobjects))):
+            so = self.sweepobjects[level]
+            n_point = len(so.point_function.get_paramstruct())
+            n_set = len(so.set_function.get_paramstruct())
+            self.slots[level] = (slice(i, i+n_point), i+n_point, slice(i+n_point+1, i+n_point+1+n_set))
+            i += n_point+1+n_set
+        self.measure_slot = slice(i, len(self.layout))
+        return self.layout
+
+    def resume_from(self, state):
+        '''
+        Continue the next run after the last pass of the innermost sweep that was completed in a checkpoint
+
+        The points of the sweeps that were running are taken from the checkpoint, their point_functions are not
+        called again. The setpoints of these sweeps are set again before the measurement continues.
+
+        :param state: the checkpoint, see read_checkpoint
+        :return: whether there are points left to measure
+        '''
+        if state['columns'] != self.layout.names:
+            raise ValueError('The checkpoint belongs to a measurement with other columns: '+', '.join(state['columns']))
+        self.resume_passes = list(state['passes'])
+        self.resume_levels = {}
+        self.resume_complete = True
+        if state['complete']:
+            return False
+        # the pass of the innermost sweep at the positions of the checkpoint is complete, so the next position
+        # is found like an odometer. Sweeps that completed their pass are started anew by the sweep around them
+        carry = True
+        for level in range(1, len(self.sweepobjects)):
+            points, index, point_values = state['levels'][level]
+            if carry:
+                index += 1
+                carry = index == len(points)
+                if carry:
+                    continue
+            self.resume_levels[level] = (points, index, point_values)
+        self.resume_complete = carry
+        return not carry
+
+    def run(self, datasaver, dict_waterfall):
+        self.timer = Timer(self.get_npoints())
+        self.datasaver = datasaver
+        self.dict_waterfall = dict_waterfall
+        self.row = self.layout.new_row()
+        datasaver.bind_layout(self.layout)
+        self.bind_stages(datasaver)
+        # number of passes every sweep level has started, to determine the direction of serpentine sweeps
+        self.passes = [0]*len(self.sweepobjects)
+        # the points and the position of every sweep level, only kept for checkpoints
+        self.points = [None]*len(self.sweepobjects)
+        self.position = [0]*len(self.sweepobjects)
+        # the instruments might have been changed since the previous sweep
+        for so in self.sweepobjects:
+            if so.setpoint_cache is not None:
+                so.setpoint_cache.invalidate()
+        resume = self.resume_levels is not None
+        if resume:
+            if self.resume_complete:
+                return
+            self.passes = list(self.resume_passes)
+        if self.sampler is not None:
+            self.sampler.start(self, datasaver, append=resume)
+        try:
+            if self.sweepobjects:
+                self._run_level(len(self.sweepobjects)-1, resume)
+            else:
+                self._measure_point()
+                self.write_block()
+        finally:
+            if self.sampler is not None:
+                self.sampler.stop()
+            # the threads of measurement functions that are combined with |
+            self.measure.shutdown()
+            for so in self.sweepobjects:
+                so.point_function.shutdown()
+                so.set_function.shutdown()
+        if self.checkpoint is not None:
+            self.write_checkpoint(complete=True)
+
+    def write_checkpoint(self, complete=False):
+        row = self.row
+        levels = {level: (self.points[level], self.position[level], row[self.slots[level][0]])
+                  for level in range(1, len(self.sweepobjects))}
+        write_checkpoint(self.checkpoint, {'columns': self.layout.names,
+                                           'levels': levels,
+                                           'passes': list(self.passes),
+                                           'complete': complete,
+                                           'backend': self.datasaver.checkpoint()})
+
+    def bind_stages(self, datasaver):
+        # the functions called in the loop, wrapped with a timer when the sweep is profiled
+        self.point_functions = [so.point_function for so in self.sweepobjects]
+        self.set_functions = [so.set_function for so in self.sweepobjects]
+        self.measure_function = self.measure
+        self.add_row = datasaver.add_row
+        self.write_line = datasaver.write_line
+        self.write_block = datasaver.write_block
+        if self.sampler is not None:
+            self.write_block = self._sampled(self.write_block)
+        if self.profile is None:
+            return
+        timed = self.profile.timed
+        for level, so in enumerate(self.sweepobjects):
+            self.point_functions[level] = timed(so.point_function, 'point_function', so.label)
+            self.set_functions[level] = timed(so.set_function, 'set_function', so.label)
+        self.measure_function = timed(self.measure, 'measure', 'measure')
+        self.add_row = timed(datasaver.add_row, 'add_row', 'measure')
+        self.write_line = timed(datasaver.write_line, 'write_line', 'measure')
+        # a block ends with every pass of the innermost sweep
+        block_axis = self.sweepobjects[0].label if self.sweepobjects else 'measure'
+        self.write_block = timed(self.write_block, 'write_block', block_axis)
+
+    def _sampled(self, write_block):
+        # the sampler takes its samples after every pass of the innermost sweep
+        sampler = self.sampler
+
+        def sampled_write_block():
+            write_block()
+            sampler.trigger()
+        return sampled_write_block
+
+    def _run_level(self, level, resume=False):
+        so = self.sweepobjects[level]
+        row = self.row
+        dict_waterfall = self.dict_waterfall
+        point_slot, value_slot, set_slot = self.slots[level]
+        set_function = self.set_functions[level]
+
+        begin = 0
+        if resume and level in self.resume_levels:
+            # continue a pass that was running when the checkpoint was written
+            points, begin, row[point_slot] = self.resume_levels[level]
+        else:
+            # only the sweeps around this one continue a pass, this one and the ones inside it start anew
+            resume = False
+            # a point_function that was executed to resolve the dataparameter is not executed again for the first pass
+            resolved_points = so.take_resolved_points()
+            if resolved_points is None:
+                resolved_points = self.point_functions[level](dict_waterfall)
+            points, row[point_slot] = resolved_points
+            if so.serpentine:
+                if self.passes[level] % 2:
+                    points = list(points)[::-1]
+                self.passes[level] += 1
+        if self.checkpoint is not None:
+            if not hasattr(points, '__getitem__'):
+                raise ValueError('The points of '+str(so.label)+' are chosen while measuring, '
+                                 'a sweep with such points can not be checkpointed')
+            self.points[level] = points
+            points = points[begin:]
+
+        if level:
+            position = self.position
+            for i, value in enumerate(points, begin):
+                position[level] = i
+                row[value_slot] = value
+                row[set_slot] = set_function(value, dict_waterfall)
+                self._run_level(level-1, resume)
+                resume = False
+        else:
+            if so.hardware:
+                self._measure_line(points, set_function, value_slot, set_slot)
+            else:
+                for value in points:
+                    row[value_slot] = value
+                    row[set_slot] = set_function(value, dict_waterfall)
+                    self._measure_point()
+            self.write_block()
+            if self.checkpoint is not None:
+                self.write_checkpoint()
+
+    def _measure_point(self):
+        row = self.row
+        row[self.measure_slot] = self.measure_function(self.dict_waterfall)
+        if len(row) != len(self.layout):
+            raise ValueError('A measurement function returned a different number of values than its paramstruct '
+                             'declares, expected a row of '+str(len(self.layout))+' values but got '+str(len(row)))
+        self.add_row(row)
+        self.write_line()
+        self.timer.update(1)
+
+    def _measure_line(self, points, set_function, value_slot, set_slot):
+        # a hardware sweep sets and measures all points of a pass in a single call each
+        row = self.row
+        dict_waterfall = self.dict_waterfall
+        points = list(points)
+        set_values = set_function(points, dict_waterfall)
+        measured = self.measure_function(dict_waterfall)
+        for values, slots, name in [(set_values, set_slot, 'set function'),
+                                    (measured, self.measure_slot, 'measurement')]:
+            expected = slots.stop-slots.start
+            if len(values) != expected:
+                raise ValueError('The '+name+' of a hardware sweep returned a different number of values than its '
+                                 'paramstruct declares, expected '+str(expected)+' but got '+str(len(values)))
+            for value in values:
+                if len(value) != len(points):
+                    raise ValueError('The '+name+' of a hardware sweep has to return a value for each of the '
+                                     +str(len(points))+' points, but returned '+str(len(value)))
+        # hand the values to the DataSaver point by point, like those of a software sweep
+        set_rows = list(zip(*set_values)) if set_values else [()]*len(points)
+        measured_rows = list(zip(*measured)) if measured else [()]*len(points)
+        for value, set_row, measured_row in zip(points, set_rows, measured_rows):
+            row[value_slot] = value
+            row[set_slot] = set_row
+            row[self.measure_slot] = measured_row
+            self.add_row(row)
+            self.write_line()
+        self.timer.update(len(points))
@@ -1,33 +1,136 @@
+import copy
+import time
+
+import numpy as np
+
 from pysweep.core.measurementfunctions import MeasurementFunction
 from pysweep.databackends.base import DataParameter, DataParameterFixedSweep
 
+
+class SetpointCache:
+    def __init__(self, tolerance=0, max_age=None):
+        '''
+        Remembers the last value a set function applied, such that setting the same value again can be skipped
+
+        :param tolerance: a new value that differs at most this much from the last applied value is not set again
+        :param max_age: when not None, the cached value is only trusted for this many seconds
+        '''
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self.value = None
+        self.valid = False
+        self.time = None
+        self.applied = 0  # number of sets that were sent to the instrument
+        self.skipped = 0  # number of sets that were skipped
+
+    def invalidate(self):
+        # call this whenever the parameter might have been changed outside of the set function
+        self.valid = False
+
+    def is_set(self, value) -> bool:
+        if not self.valid:
+            return False
+        if self.max_age is not None and time.time() - self.time > self.max_age:
+            return False
+        if isinstance(value, np.ndarray) or isinstance(self.value, np.ndarray):
+            # array setpoints are only the same when they have the same shape and all elements are within tolerance
+            try:
+                return (np.shape(value) == np.shape(self.value) and
+                        bool(np.all(np.abs(np.subtract(value, self.value)) <= self.tolerance)))
+            except TypeError:
+                return False
+        try:
+            return abs(value - self.value) <= self.tolerance
+        except TypeError:
+            return value == self.value
+
+    def update(self, value):
+        # a copy, such that changing the array that was set afterwards does not change the cached value
+        self.value = value.copy() if isinstance(value, np.ndarray) else value
+        self.valid = True
+        self.time = time.time()
+
+
 class SweepObject:
-    def __init__(self, set_function, unit, label, point_function, dataparameter=None):
+    # placeholder axes (see pysweep.none) are skipped by the sweep engine
+    dummy = False
+    # a hardware sweep sets all its points at once, see HardwareSweepObject
+    hardware = False
+
+    def __init__(self, set_function, unit, label, point_function, dataparameter=None, setpoint_cache=None,
+                 serpentine=False):
         '''
 
         :param set_function:
         :param unit:
         :param label:
         :param point_function:
-        :param dataparameter: when this parameter is None (default), the point_function will be executed once to determine the dataparameter
+        :param dataparameter: a DataParameter, or a list that contains a mock version of the points we will be sweeping over.
+            When this parameter is None (default), the points declared by the point_function (see MakeMeasurementFunction)
+            are used, and otherwise the point_function is executed once with the dict_waterfall of the sweep when the
+            dataparameter is first needed. The points of that execution are then also the points of the first pass
+        :param setpoint_cache: the SetpointCache used by the set_function, if any. It is invalidated at the start of every sweep
+        :param serpentine: when True, the points are swept in reverse order on every other pass of this sweep, such that
+            the parameter does not have to return to the first point after every pass. Has no effect on the outermost sweep
         '''
         self.set_function = set_function
+        self.setpoint_cache = setpoint_cache
         self.unit = unit
         self.label = label
         self.point_function = point_function
-        if dataparameter is None:
-            points, _ = self.point_function({})
-            self.dataparameter = DataParameterFixedSweep(self.label, self.unit, 'numeric', points[0], points[-1], len(points))
-        elif isinstance(dataparameter, DataParameter):
-            self.dataparameter = dataparameter
-        else:
-            # assume that dataparameter is some list that contains a mock version of the points we will be sweeping over
-            self.dataparameter = DataParameterFixedSweep(self.label, self.unit, 'numeric', dataparameter[0], dataparameter[-1], len(dataparameter))
+        self.declared_dataparameter = dataparameter
+        self.dataparameter = None  # resolved when it is first needed, see get_dataparameter
+        self.executed = False  # was the point_function executed to resolve the dataparameter
+        self.resolved_points = None  # what that execution returned, the sweep engine uses it for the first pass
+        self.serpentine = serpentine
         if not isinstance(self.set_function, MeasurementFunction):
             raise TypeError('Set function '+repr(self.set_function)+ ' is not of type pysweep.core.measurementfunctions.MeasurementFunction')
 
         if not isinstance(self.point_function, MeasurementFunction):
             raise TypeError('Set function '+repr(self.set_function)+ ' is not of type pysweep.core.measurementfunctions.MeasurementFunction')
 
-    def get_dataparameter(self) -> DataParameter:
+    def get_dataparameter(self, dict_waterfall=None) -> DataParameter:
+        if self.dataparameter is None:
+            self.dataparameter = self.resolve_dataparameter(dict_waterfall)
         return self.dataparameter
+
+    def forget_dataparameter(self):
+        # points that had to be measured can be different in the next sweep, declared points can not
+        if self.executed:
+            self.dataparameter = None
+            self.executed = False
+            self.resolved_points = None
+
+    def take_resolved_points(self):
+        # the points and values that the point_function returned when it was executed to resolve the dataparameter,
+        # or None. They are only handed out once, the next passes execute the point_function again
+        resolved_points, self.resolved_points = self.resolved_points, None
+        return resolved_points
+
+    def resolve_dataparameter(self, dict_waterfall=None) -> DataParameter:
+        points = self.declared_dataparameter
+        if points is None:
+            points = self.point_function.points
+        if points is None:
+            self.resolved_points = self.point_function({} if dict_waterfall is None else dict_waterfall)
+            points = self.resolved_points[0]
+            self.executed = True
+        if isinstance(points, DataParameter):
+            dataparameter = points
+        else:
+            dataparameter = DataParameterFixedSweep(self.label, self.unit, 'numeric', points[0], points[-1], len(points))
+        # backends that place data on a grid by counting points need to know about the serpentine order. The flag is
+        # set on a copy, the DataParameter that was passed in can be shared with other sweeps
+        if self.serpentine:
+            dataparameter = copy.copy(dataparameter)
+            dataparameter.serpentine = True
+        return dataparameter
+
+
+class HardwareSweepObject(SweepObject):
+    # The instrument sweeps the points itself, for example an AWG that plays a ramp or a DMM that takes a triggered
+    # buffer. The set_function is called once per pass with the list of all points as its first argument, and the
+    # measurement function is called once per pass as well. Both return, for every DataParameter of their paramstruct,
+    # a sequence with one value per point. The sweep engine then hands the values to the DataSaver point by point,
+    # exactly like those of a software sweep. Only the innermost sweep can be a hardware sweep
+    hardware = True
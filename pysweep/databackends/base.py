@@ -1,3 +1,5 @@
+import warnings
+
 # The DataParameter class stores all information that belongs to a single data column
 class DataParameter:
     def __init__(self, name, unit, paramtype='numeric', independent=False, extra_dependencies=None, duplicate=False):
@@ -20,6 +22,9 @@ class DataParameter:
         return " ".join(r)
 
 class DataParameterFixedSweep(DataParameter):
+    # A serpentine sweep runs in reverse order on every odd (counting from 0) pass, see SweepObject
+    serpentine = False
+
     def __init__(self, name, unit, paramtype, start, stop, npoints, independent=True):
         super().__init__(name, unit, paramtype, independent)
         self.start = start
@@ -39,6 +44,54 @@ class DataParameterFixedAxis(DataParameterFixedSweep):
         r = [str(self.__class__), str(self.name), str(self.unit), str(self.paramtype), str(self.independent)]
         return " ".join(r)
 
+# Determine for every dependent the independents it depends on, in the order of the paramstructure.
+# Sweeps with a single point are not counted as an axis
+def get_axes(paramstructure):
+    setpoints = []  # independents that all following dependents depend on
+    independents = {}  # name -> DataParameter of all independents that form an axis
+    names = []
+    axes = {}
+    for param in paramstructure:
+        if param.independent:
+            if not (isinstance(param, DataParameterFixedSweep) and param.npoints == 1):
+                # For parameters that will be the independent for a few explicitely defined parameters, we do not want to add it as an automatic independent
+                if not param.independent == 2:
+                    setpoints.append(param.name)
+                independents[param.name] = param
+        elif not param.duplicate:
+            dependencies = setpoints+param.extra_dependencies
+            axes[param.name] = [independents[name] for name in names if name in dependencies and name in independents]
+        names.append(param.name)
+    return axes
+
+# The shape of every dependent, as far as it can be known in advance: every independent with a fixed number of points
+# contributes an axis of that length, other independents an axis of unknown length (None)
+def get_datashapes(paramstructure):
+    datashapes = {}
+    for name, axes in get_axes(paramstructure).items():
+        datashapes[name] = [axis.npoints if isinstance(axis, DataParameterFixedSweep) else None for axis in axes]
+    return datashapes
+
+# A RowLayout describes how pysweep hands a measured point to a DataSaver: as a row, which is a list with one slot
+# per DataParameter of the paramstructure, in the same order. The layout is compiled once before the measurement starts
+class RowLayout:
+    def __init__(self, paramstructure):
+        self.params = list(paramstructure)
+        self.names = [param.name for param in self.params]
+        self.index = {}  # name -> slot, for duplicate names the first slot is used
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+
+    def __len__(self):
+        return len(self.params)
+
+    def new_row(self):
+        return [None]*len(self.params)
+
+    def as_line(self, row):
+        # convert a row into the list of (name, value) tuples that add_to_line expects
+        return list(zip(self.names, row))
+
 # A databackend is responsible for storing the information that that is acquired by pysweep
 # Since different situations could use different backends,
 # this file defines the interface that pysweep will use to control the data backend
@@ -64,13 +117,35 @@ class DataBackend:
         '''
         raise NotImplementedError()
 
+    # This function is called after setup when a measurement is resumed from a checkpoint, with the state that the
+    # DataSaver returned from checkpoint. The DataSaver should then continue writing at that position
+    def resume(self, state):
+        raise NotImplementedError(self.__class__.__name__+' can not resume a measurement')
+
+    # Whether this DataBackend implements resume. pysweep checks this before a measurement with checkpoints starts,
+    # instead of finding out when the measurement has crashed and is resumed
+    def can_resume(self):
+        return type(self).resume is not DataBackend.resume
+
 # This class defines how
 class DataSaver:
+    layout = None
+
     # pysweep will dump line information here which will consists
     # of a list of tuples with name, value to store
     def add_to_line(self, line):
         raise NotImplementedError()
 
+    # This function is called once before the first row arrives with the RowLayout of the rows
+    def bind_layout(self, layout):
+        self.layout = layout
+
+    # pysweep hands over every point as a row (see RowLayout). The row buffer is reused for the next point,
+    # so a DataSaver has to copy whatever it wants to keep. The default implementation falls back on add_to_line,
+    # DataSavers that care about speed override this with index based storage
+    def add_row(self, row):
+        self.add_to_line(self.layout.as_line(row))
+
     # This functions will be called to signal that all values that are added to the new mine are final
     # and can be written away
     def write_line(self):
@@ -80,38 +155,125 @@ class DataSaver:
     def write_block(self):
         raise NotImplementedError()
 
+    # This function is called instead of add_row and write_line for n points that were measured but not handed to
+    # this DataSaver, because a ThreadedDataBackend dropped or decimated them. DataSavers that find the position of
+    # a point by counting points advance their count here
+    def skip_points(self, n):
+        pass
+
+    # When checkpoints are written, this function is called after every write_block. It should make sure all data
+    # up to now is stored and return a picklable description of the write position, which is passed to resume
+    def checkpoint(self):
+        return None
+
+    # The file next to the data where a ParameterSampler stores the parameters it samples during the measurement,
+    # None when there is no such place
+    def samples_filename(self):
+        return None
+
 class CombinedDataBackend(DataBackend, DataSaver):
-    def __init__(self, databackends):
+    def __init__(self, databackends, threaded=False, maxsize=1000):
+        '''
+        Write the same data to several DataBackends
+
+        :param databackends: the DataBackends to write to. A slow backend that does not need all data can be passed
+            wrapped in a ThreadedDataBackend that drops or decimates points, such that it never holds up the measurement
+        :param threaded: when False (default), the backends are called one after another in the measurement thread.
+            When True, every DataBackend gets its own queue and writer thread (see ThreadedDataBackend), such that a
+            slow backend does not hold up the others. The data then reaches the backends later than the measurement,
+            and by default their errors are only raised at the next point
+        :param maxsize: size of the queue of every backend that is not wrapped in a ThreadedDataBackend yet
+        '''
+        if threaded:
+            # imported here, since the threaded module builds on this one
+            from pysweep.databackends.threaded import ThreadedDataBackend
+            databackends = [db if isinstance(db, ThreadedDataBackend) else ThreadedDataBackend(db, maxsize)
+                            for db in databackends]
         self.databackends = databackends
         self.datasavers = None
+        self.errors = []  # (index, databackend, exception) of every backend that failed
 
-    def setup(self, paramstructure):
+    def setup(self, paramstructure, dict_waterfall):
         for db in self.databackends:
-            db.setup(paramstructure)
+            db.setup(paramstructure, dict_waterfall)
 
     def __enter__(self):
         self.datasavers = []
+        self.errors = []
         for db in self.databackends:
-            self.datasavers.append(db.__enter__())
+            try:
+                self.datasavers.append(db.__enter__())
+            except BaseException as e:
+                # close the backends that were entered already
+                for entered in self.databackends[:len(self.datasavers)]:
+                    entered.__exit__(type(e), e, e.__traceback__)
+                raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        for db in self.databackends:
-            db.__exit__( exc_type, exc_val, exc_tb)
+        # every backend is closed, also when another one fails
+        for i, db in enumerate(self.databackends):
+            try:
+                db.__exit__(exc_type, exc_val, exc_tb)
+            except Exception as e:
+                self.errors.append((i, db, e))
+            else:
+                # errors of a writer thread that were already raised in the measurement thread
+                if getattr(db, 'error', None) is not None and not getattr(db, 'reported', False):
+                    self.errors.append((i, db, db.error))
+        # backends that are not critical, or that reported their error as a warning already, are not reported again
+        critical = [(i, db, e) for i, db, e in self.errors if getattr(db, 'critical', True)]
+        if critical:
+            message = 'Databackends failed: '+'; '.join(str(i)+' ('+self.backend_name(db)+'): '+repr(e)
+                                                        for i, db, e in critical)
+            if exc_type is None:
+                raise RuntimeError(message) from critical[0][2]
+            # the error of the measurement is raised, the errors of the backends are reported along with it
+            warnings.warn(message)
+
+    @staticmethod
+    def backend_name(db):
+        return getattr(db, 'databackend', db).__class__.__name__
+
+    def bind_layout(self, layout):
+        self.layout = layout
+        for ds in self.datasavers:
+            ds.bind_layout(layout)
 
     def add_to_line(self, line):
-        for db in self.databackends:
-            db.add_to_line(line)
+        for ds in self.datasavers:
+            ds.add_to_line(line)
+
+    def add_row(self, row):
+        for ds in self.datasavers:
+            ds.add_row(row)
 
     def write_line(self):
-        for db in self.databackends:
-            db.write_line()
+        for ds in self.datasavers:
+            ds.write_line()
 
     def write_block(self):
-        for db in self.databackends:
-            db.write_block()
+        for ds in self.datasavers:
+            ds.write_block()
 
+    def skip_points(self, n):
+        for ds in self.datasavers:
+            ds.skip_points(n)
 
+    def resume(self, state):
+        for db, db_state in zip(self.databackends, state):
+            db.resume(db_state)
 
+    def can_resume(self):
+        return all(db.can_resume() for db in self.databackends)
 
+    def checkpoint(self):
+        return [ds.checkpoint() for ds in self.datasavers]
 
+    def samples_filename(self):
+        # next to the data of the first DataBackend that stores to files
+        for ds in self.datasavers:
+            filename = ds.samples_filename()
+            if filename is not None:
+                return filename
+        return None
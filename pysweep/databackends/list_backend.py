@@ -1,25 +1,120 @@
+import numpy as np
+
 import pysweep.databackends.base as base
 
+'''
+An in-memory databackend that stores every column as a NumPy array.
+When the measurement finishes, data holds a dict with one array per column and, for measurements
+on a regular grid, grids holds the same data shaped as an N-dimensional array with one axis per sweep.
+'''
+
+
 class ListDataBackend(base.DataBackend, base.DataSaver):
     def __init__(self):
         self.paramstruct = None
-        self.lines = []
+        self.names = None
+        self.index = None  # name -> column
+        self.columns = None  # one array per column, allocated at the first row
+        self.nrows = 0
+        self.capacity = 0
+        self.sweep_shape = None  # number of points of every sweep, outermost first
+        self.serpentine = None  # for every sweep, whether it is a serpentine sweep
+
+        self.data = None
+        self.grids = None
 
     def setup(self, paramstructure, dict_waterfall):
         self.paramstruct = paramstructure
+        self.names = [param.name for param in paramstructure]
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+        self.columns = [None]*len(paramstructure)
+        self.nrows = 0
+        self.data = None
+        self.grids = None
+
+        # the sweeps are the independents with a fixed number of points that are not returned as arrays
+        sweeps = [param for param in paramstructure if param.independent and
+                  isinstance(param, base.DataParameterFixedSweep) and
+                  not isinstance(param, base.DataParameterFixedAxis)]
+        self.sweep_shape = [param.npoints for param in sweeps]
+        self.serpentine = [param.serpentine for param in sweeps]
+        self.capacity = max(int(np.prod([param.npoints for param in sweeps])), 1)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
+        self.data = {}
+        for name, column in zip(self.names, self.columns):
+            if name not in self.data and column is not None:
+                self.data[name] = column[:self.nrows]
+        self.grids = self.make_grids()
 
     def add_to_line(self, line):
-        self.lines.append(line)
+        row = [None]*len(self.names)
+        for name, value in line:
+            row[self.index[name]] = value
+        self.add_row(row)
+
+    def add_row(self, row):
+        if self.nrows == 0:
+            self.allocate(row)
+        elif self.nrows == self.capacity:
+            # grow geometrically, such that appending stays cheap for sweeps of unknown length
+            self.columns = [np.concatenate([column, np.empty_like(column)]) for column in self.columns]
+            self.capacity *= 2
+        for i, value in enumerate(row):
+            try:
+                self.columns[i][self.nrows] = value
+            except (ValueError, TypeError):
+                # the value does not fit the shape or type of the first value, fall back on storing objects
+                self.columns[i] = self.as_objects(self.columns[i])
+                self.columns[i][self.nrows] = value
+        self.nrows += 1
+
+    def as_objects(self, column):
+        objects = np.empty((self.capacity,), dtype=object)
+        for i in range(self.nrows):
+            objects[i] = column[i]
+        return objects
+
+    def allocate(self, row):
+        # the shape and type of every column is taken from its first value
+        for i, (param, value) in enumerate(zip(self.paramstruct, row)):
+            value = np.asarray(value)
+            if param.paramtype in ('numeric', 'array', 'complex') and value.dtype.kind in 'biufc':
+                dtype = complex if value.dtype.kind == 'c' else float
+                self.columns[i] = np.empty((self.capacity,)+value.shape, dtype=dtype)
+            else:
+                self.columns[i] = np.empty((self.capacity,), dtype=object)
+
+    def make_grids(self):
+        # only a measurement that completed all points of all sweeps fits on the grid
+        if self.nrows != int(np.prod(self.sweep_shape)):
+            return None
+        grids = {}
+        for name, values in self.data.items():
+            grid = values.reshape(tuple(self.sweep_shape)+values.shape[1:]).copy()
+            # every odd pass of a serpentine sweep was measured backwards. The innermost sweep is turned around
+            # first, such that the sweeps around it are still in the order they were measured in, which is the
+            # order that counts the passes
+            for axis, serpentine in reversed(list(enumerate(self.serpentine))):
+                if serpentine and axis > 0:
+                    passes = grid.reshape((int(np.prod(self.sweep_shape[:axis])),)+grid.shape[axis:])
+                    passes[1::2] = passes[1::2, ::-1].copy()
+            grids[name] = grid
+        return grids
+
+    @property
+    def lines(self):
+        # the stored data as a list of lines of (name, value) tuples
+        return [[(name, column[i]) for name, column in zip(self.names, self.columns)]
+                for i in range(self.nrows)]
 
     def write_line(self):
         pass
 
     def write_block(self):
         pass
-
@@ -0,0 +1,329 @@
+import json
+import os
+import zlib
+
+import numpy as np
+
+import pysweep.databackends.base as base
+
+'''
+A databackend for large gridded measurements. Every column gets its own memory-mapped .npy file, shaped
+like the grid of the sweeps it depends on (see base.get_datashapes), and every point is written straight
+into its slot of the grid. A small json sidecar describes the axes and units and counts the points that
+are written, so the data can be opened with load() while the measurement is still running.
+
+Only measurements on a regular grid are supported: every sweep needs a fixed number of points and every
+other independent must be a DataParameterFixedAxis.
+
+Array columns (traces on a DataParameterFixedAxis) can optionally be stored compressed, in chunks that hold one pass
+of the innermost sweep each. An index, itself a memory-mapped .npy file, gives the position of every chunk in the
+data file, such that load() only decompresses the chunks that are read.
+'''
+
+SIDECAR = 'pysweep.json'
+CODEC = 'shuffle-zlib'
+
+
+def compress_chunk(array, level=1) -> bytes:
+    # the bytes of the values are shuffled, the first byte of every value first, then the second byte and so on,
+    # which makes the slowly varying high bytes of floating point data compress well
+    data = np.ascontiguousarray(array)
+    shuffled = data.view(np.uint8).reshape(-1, data.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def decompress_chunk(data, dtype, shape) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(shape)
+
+
+class ChunkedArray:
+    def __init__(self, path, column):
+        '''
+        Read-only access to a compressed column, indexed like a numpy array. Only the chunks that hold the
+        requested points are read and decompressed, points that are not measured (yet) are NaN
+
+        :param path: the directory of the measurement
+        :param column: the description of the column in the sidecar
+        '''
+        self.filename = os.path.join(path, column['file'])
+        self.index = np.load(os.path.join(path, column['index']), mmap_mode='r')
+        self.dtype = np.dtype(column['dtype'])
+        self.shape = tuple(column['shape'])
+        self.ndim = len(self.shape)
+        self.chunk_dims = column['chunk_dims']
+        self.chunk_shape = self.shape[self.chunk_dims:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[...], dtype=dtype)
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i]+(slice(None),)*(self.ndim-len(key)+1)+key[i+1:]
+        key = key+(slice(None),)*(self.ndim-len(key))
+        # the numbers of the chunks that are selected by the leading indices
+        chunks = np.arange(int(np.prod(self.shape[:self.chunk_dims]))).reshape(self.shape[:self.chunk_dims])
+        chunks = chunks[key[:self.chunk_dims]]
+        data = np.empty(chunks.shape+self.chunk_shape, dtype=self.dtype)
+        with open(self.filename, 'rb') as f:
+            for i, chunk in np.ndenumerate(chunks):
+                offset, length = self.index.reshape(-1, 2)[chunk]
+                if offset < 0:
+                    data[i] = np.nan
+                    continue
+                f.seek(offset)
+                data[i] = decompress_chunk(f.read(length), self.dtype, self.chunk_shape)
+        return data[(slice(None),)*chunks.ndim+key[self.chunk_dims:]]
+
+
+class ChunkedColumn:
+    def __init__(self, path, name, dtype, shape, chunk_dims, level=1, resume=False):
+        '''
+        Writes a column in compressed chunks, assigned to like a numpy array. The values of a chunk are kept in
+        memory until flush
+
+        :param path: the directory of the measurement
+        :param name: the name of the column
+        :param dtype: dtype of the values
+        :param shape: shape of the column
+        :param chunk_dims: number of leading dimensions that select a chunk, the other dimensions form the chunk
+        :param level: zlib compression level
+        :param resume: continue writing the files of a measurement that is resumed
+        '''
+        self.dtype = np.dtype(dtype)
+        self.chunk_dims = chunk_dims
+        self.chunk_shape = tuple(shape[chunk_dims:])
+        self.level = level
+        self.pending = {}  # leading indices -> values of a chunk that is not written yet
+        self.files = {'file': name+'.chunks', 'index': name+'.index.npy'}
+        index_filename = os.path.join(path, self.files['index'])
+        if resume:
+            self.index = np.lib.format.open_memmap(index_filename, mode='r+')
+            self.file = open(os.path.join(path, self.files['file']), 'r+b')
+            self.file.seek(0, os.SEEK_END)
+        else:
+            # (offset, length) of every chunk in the data file, -1 for chunks that are not written
+            self.index = np.lib.format.open_memmap(index_filename, mode='w+', dtype=np.int64,
+                                                   shape=tuple(shape[:chunk_dims])+(2,))
+            self.index[...] = -1
+            self.file = open(os.path.join(path, self.files['file']), 'wb')
+
+    def __setitem__(self, key, value):
+        chunk = key[:self.chunk_dims]
+        if chunk not in self.pending:
+            self.pending[chunk] = np.full(self.chunk_shape, np.nan, dtype=self.dtype)
+        self.pending[chunk][key[self.chunk_dims:]] = value
+
+    def flush(self):
+        # compress and write the chunks that were assigned to since the previous flush
+        for chunk, values in self.pending.items():
+            data = compress_chunk(values, self.level)
+            self.index[chunk] = (self.file.tell(), len(data))
+            self.file.write(data)
+        self.pending = {}
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def load(path):
+    '''
+    Open a measurement written by MemmapDataBackend, also while it is still running
+
+    :param path: the directory of the measurement
+    :return: the sidecar metadata and a dict with a read-only memory-mapped array for every column, or a
+        ChunkedArray for compressed columns. Points that are not measured (yet) are NaN
+    '''
+    with open(os.path.join(path, SIDECAR)) as f:
+        meta = json.load(f)
+    data = {}
+    for name, column in meta['columns'].items():
+        if column.get('codec') == CODEC:
+            data[name] = ChunkedArray(path, column)
+        else:
+            data[name] = np.load(os.path.join(path, column['file']), mmap_mode='r')
+    return meta, data
+
+
+class MemmapDataBackend(base.DataBackend, base.DataSaver):
+    def __init__(self, path, compress=False, level=1):
+        '''
+
+        :param path: directory to write the measurement to, it is created if it does not exist
+        :param compress: store the array columns, those on a DataParameterFixedAxis, compressed in chunks of one
+            pass of the innermost sweep, see ChunkedColumn. The other columns are always stored uncompressed
+        :param level: zlib compression level of compressed columns, from 1 (fastest) to 9 (smallest)
+        '''
+        self.path = path
+        self.compress = compress
+        self.level = level
+        self.paramstructure = None
+        self.sweeps = None  # the sweeps, outermost first
+        self.plan = None  # (slot, indices of the sweeps that index it, ...) for every column that is written
+        self.arrays = None
+        self.chunked = None  # the ChunkedColumns among the arrays, which are written at the end of every block
+        self.meta = None
+        self.loop_index = None  # index of every sweep in the order it is measured
+        self.npoints = 0
+        self.resume_state = None
+
+    def setup(self, paramstructure, dict_waterfall):
+        self.paramstructure = paramstructure
+        # the sweeps are the independents with a fixed number of points that are not returned as arrays
+        self.sweeps = [param for param in paramstructure if param.independent and
+                       isinstance(param, base.DataParameterFixedSweep) and
+                       not isinstance(param, base.DataParameterFixedAxis)]
+        sweep_index = {param.name: i for i, param in enumerate(self.sweeps)}
+
+        self.meta = {'axes': {}, 'columns': {}, 'points': 0, 'complete': False}
+        for param in paramstructure:
+            if isinstance(param, base.DataParameterFixedAxis):
+                self.meta['axes'][param.name] = {'unit': param.unit,
+                                                 'coordinates': np.asarray(param.coordinates).tolist()}
+            elif isinstance(param, base.DataParameterFixedSweep) and param.independent:
+                self.meta['axes'][param.name] = {'unit': param.unit, 'start': param.start, 'stop': param.stop,
+                                                 'npoints': param.npoints, 'serpentine': param.serpentine}
+
+        # every column is described by the axes it is stored on: the values of a sweep are stored on the grid of
+        # the sweeps up to itself, dependents on the grid of the independents they depend on
+        columns = []
+        for i, param in enumerate(self.sweeps):
+            columns.append((param, [sweep for sweep in self.sweeps[:i] if sweep.npoints > 1]+[param]))
+        for name, axes in base.get_axes(paramstructure).items():
+            param = next(param for param in paramstructure if param.name == name and not param.independent)
+            columns.append((param, axes))
+
+        irregular = [param.name for param in paramstructure if not param.duplicate and
+                     not isinstance(param, base.DataParameterFixedSweep) and param.independent]
+        irregular += [param.name for param, axes in columns
+                      if any(not isinstance(axis, base.DataParameterFixedSweep) for axis in axes)]
+        if irregular:
+            raise ValueError('MemmapDataBackend only supports data on a regular grid, '
+                             'these columns can not be placed on the grid: '+', '.join(irregular))
+
+        self.plan = []
+        for param, axes in columns:
+            if param.paramtype not in ('numeric', 'array', 'complex'):
+                raise ValueError('MemmapDataBackend does not support columns of type '+str(param.paramtype))
+            # the values of an array column fill the axes that the loop does not index
+            if param.paramtype == 'array' and not any(isinstance(axis, base.DataParameterFixedAxis) for axis in axes):
+                raise ValueError('MemmapDataBackend needs a DataParameterFixedAxis for the array column '+param.name+
+                                 ', to know the shape of its values')
+            slot = paramstructure.index(param)
+            # axes that are sweeps are indexed by the loop, other axes are filled by the (array) value
+            indices = tuple(sweep_index[axis.name] for axis in axes if axis.name in sweep_index)
+            self.plan.append((slot, indices, param, axes))
+        self.meta['sweeps'] = [param.name for param in self.sweeps]
+        self.resume_state = None
+
+    def resume(self, state):
+        # continue writing to the arrays of the checkpoint, the points after it are measured again
+        self.resume_state = state
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.arrays = {}
+        compiled = []
+        for slot, indices, param, axes in self.plan:
+            filename = param.name+'.npy'
+            dtype = complex if param.paramtype == 'complex' else float
+            shape = tuple(axis.npoints for axis in axes)
+            column = {'file': filename, 'unit': param.unit, 'paramtype': param.paramtype,
+                      'independent': bool(param.independent), 'axes': [axis.name for axis in axes]}
+            if self.compress and len(indices) < len(axes):
+                # a chunk holds a pass of the innermost sweep, or a single point for columns that do not depend on it
+                chunk_dims = len(indices)-1 if indices and indices[-1] == len(self.sweeps)-1 else len(indices)
+                array = ChunkedColumn(self.path, param.name, dtype, shape, chunk_dims, level=self.level,
+                                      resume=self.resume_state is not None)
+                column.update(array.files, codec=CODEC, dtype=np.dtype(dtype).str, shape=list(shape),
+                              chunk_dims=chunk_dims)
+            elif self.resume_state is not None:
+                array = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='r+')
+            else:
+                array = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='w+', dtype=dtype,
+                                                  shape=shape)
+                array[...] = np.nan
+            self.arrays[param.name] = array
+            compiled.append((slot, indices, array))
+            self.meta['columns'][param.name] = column
+        self.plan = compiled
+        self.chunked = [array for array in self.arrays.values() if isinstance(array, ChunkedColumn)]
+        self.loop_index = [0]*len(self.sweeps)
+        self.npoints = 0
+        if self.resume_state is not None:
+            self.loop_index = list(self.resume_state['loop_index'])
+            self.npoints = self.resume_state['npoints']
+        self.write_sidecar()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for array in self.arrays.values():
+            if isinstance(array, ChunkedColumn):
+                array.close()
+            else:
+                array.flush()
+        self.meta['complete'] = exc_type is None
+        self.write_sidecar()
+
+    def write_sidecar(self):
+        self.meta['points'] = self.npoints
+        # write to a temporary file first, such that a reader never sees half a file
+        filename = os.path.join(self.path, SIDECAR)
+        with open(filename+'.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=4)
+        os.replace(filename+'.tmp', filename)
+
+    def grid_index(self):
+        # the position on the grid of the current point, taking the reversed passes of serpentine sweeps into account
+        index = list(self.loop_index)
+        passes = 0
+        for i, sweep in enumerate(self.sweeps):
+            if sweep.serpentine and passes % 2:
+                index[i] = sweep.npoints - 1 - index[i]
+            passes = passes*sweep.npoints + self.loop_index[i]
+        return index
+
+    def add_to_line(self, line):
+        values = dict(line)
+        self.add_row([values.get(param.name) for param in self.paramstructure])
+
+    def add_row(self, row):
+        index = self.grid_index()
+        for slot, indices, array in self.plan:
+            array[tuple([index[i] for i in indices])] = row[slot]
+
+    def write_line(self):
+        self.npoints += 1
+        # advance the loop index like an odometer, the innermost sweep first
+        for i in reversed(range(len(self.loop_index))):
+            self.loop_index[i] += 1
+            if self.loop_index[i] < self.sweeps[i].npoints:
+                break
+            self.loop_index[i] = 0
+
+    def skip_points(self, n):
+        # the points stay NaN, but the points after them are written in their place
+        for _ in range(n):
+            self.write_line()
+
+    def write_block(self):
+        for array in self.chunked:
+            array.flush()
+        self.write_sidecar()
+
+    def checkpoint(self):
+        for array in self.arrays.values():
+            array.flush()
+        return {'loop_index': list(self.loop_index), 'npoints': self.npoints}
+
+    def samples_filename(self):
+        return os.path.join(self.path, 'samples.txt')
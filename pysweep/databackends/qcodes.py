@@ -1,15 +1,32 @@
+import os
 from typing import (Sequence, Optional)
+import numpy as np
 import pysweep.databackends.base as base
+from pysweep.core.snapshots import CachedStation
 import qcodes.utils.metadata
 
-STUPIDAXES = ['None1', 'None2', 'None3']
-
 class DataBackend(base.DataBackend, base.DataSaver):
-    def __init__(self, meas):
+    def __init__(self, meas, batch_size=None, snapshot_cache=None):
+        '''
+
+        :param meas: The qcodes measurement object
+        :param batch_size: when this parameter is None (default), every point is sent to the dataset immediately.
+            Otherwise rows are kept in memory and committed to the dataset in one add_result call at the end of every
+            innermost sweep, or as soon as batch_size rows are waiting
+        :param snapshot_cache: a SnapshotCache (see pysweep.core.snapshots) of the station of meas. The snapshot that
+            qcodes stores with the run is then taken from the cache, in a worker thread that starts at setup and runs
+            during measurement_init. When None, qcodes takes a full snapshot of the station
+        '''
         self.meas = meas  # The qcodes measurement object
+        self.snapshot_cache = snapshot_cache
         self.runner = None
         self.datasaver = None
         self.columns = None
+        self.row_slots = None
+
+        self.batch_size = batch_size
+        self.batch = []  # rows waiting to be committed, only used when batch_size is not None
+        self.batch_arrays = False  # can the waiting rows be committed as one set of arrays
 
         self.station = self.meas.station
         if 'PysweepMetadata' not in self.station.components:
@@ -21,10 +38,11 @@ class DataBackend(base.DataBackend, base.DataSaver):
     def setup(self, paramstructure, dict_waterfall):
         setpoints = []  # variable to hold independent parameters registered to pysweep
         self.columns = []  # list to hold all dependent and independent columns
-        datashapes = {}  # dictionary to try and store the datashapes
-        independents = {} # dictionary to store all independents and their axis length (not the same as setpoints!)
+        self.row_slots = []  # (slot, name) of every column that is sent to add_result, compiled once for add_row
 
         dict_waterfall['STATION'] = self.station
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.start()
 
         for param in paramstructure:
 
@@ -33,30 +51,31 @@ class DataBackend(base.DataBackend, base.DataSaver):
                 if isinstance(param, base.DataParameterFixedSweep) and param.npoints==1:
                     print(param.name, ', postponing registration')
                 else:
+                    self.row_slots.append((len(self.columns), param.name))
                     if not param.duplicate:
                         if param.name in self.columns:
                             raise ValueError('Parameter name '+str(param.name)+ ' occurs multiple times in paramstruct')
                         self.meas.register_custom_parameter(param.name, unit=param.unit, paramtype=param.paramtype)
                     if not param.independent == 2:  # For parameters that will be the independent for a few explicitely defined parameters, we do not want to add it as an automatic independent
                         setpoints.append(param.name)
-                    # try to determine the axis properties of this sweep
-                    if isinstance(param, base.DataParameterFixedSweep):
-                        independents[param.name] = param.npoints
-                    else:
-                        independents[param.name] = None
             else:
+                self.row_slots.append((len(self.columns), param.name))
                 if not param.duplicate:
                     if param.name in self.columns:
                         raise ValueError('Parameter name ' + str(param.name) + ' occurs multiple times in paramstruct')
                     self.meas.register_custom_parameter(param.name, unit=param.unit, paramtype=param.paramtype,
                                                         setpoints=setpoints+param.extra_dependencies)
-                    # try to figure out the shape corresponding to this parameter
-                    # it is important however to have them in order which setpoints+param.extra_dependencies might not be
-                    # so we use the following list comprehension instead
-                    shape = [independents[name] for name in self.columns if name in setpoints+param.extra_dependencies]
-                    datashapes[param.name] = shape
             self.columns.append(param.name)
-        self.pysweepmetadata.datashapes = datashapes
+        # try to figure out the shape corresponding to every dependent
+        self.pysweepmetadata.datashapes = base.get_datashapes(paramstructure)
+        self.pysweepmetadata.resumed_from = None
+        # the data of serpentine sweeps is stored in measurement order, every odd pass of these sweeps is reversed
+        self.pysweepmetadata.serpentine = [param.name for param in paramstructure
+                                           if isinstance(param, base.DataParameterFixedSweep) and param.serpentine]
+        # qcodes unravels arrays for numeric parameters into separate rows, so a batch of numeric rows can be
+        # committed as one add_result with one array per column. Array valued columns have to go row by row
+        written_params = [paramstructure[i] for i, _ in self.row_slots]
+        self.batch_arrays = all(param.paramtype == 'numeric' for param in written_params)
         # for param in paramstructure:
         #     # Hack to exclude trivial measurement axes
         #     if param.independent:
@@ -64,80 +83,136 @@ class DataBackend(base.DataBackend, base.DataSaver):
         #             self.meas.register_custom_parameter(param.name, unit=param.unit, paramtype=param.paramtype, setpoints=setpoints)
 
     def __enter__(self):
-        self.runner = self.meas.run()
-        self.datasaver = self.runner.__enter__()
+        if self.snapshot_cache is None:
+            self.runner = self.meas.run()
+            self.datasaver = self.runner.__enter__()
+            return self
+        # qcodes takes the snapshot of the station of the measurement when the run starts. The pysweep metadata
+        # describes this measurement, so it is always taken now
+        snapshot = dict(self.snapshot_cache.get_result())
+        snapshot['components'] = dict(snapshot['components'], PysweepMetadata=self.pysweepmetadata.snapshot())
+        self.meas.station = CachedStation(self.station, snapshot)
+        try:
+            self.runner = self.meas.run()
+            self.datasaver = self.runner.__enter__()
+        finally:
+            self.meas.station = self.station
         return self
 
+    def resume(self, state):
+        # qcodes marks a run as completed when it exits, so a resumed measurement continues in a new run that
+        # refers to the run of the checkpoint. The new run starts after the last completed pass
+        self.pysweepmetadata.resumed_from = state['run_id']
+
+    def checkpoint(self):
+        self.flush()
+        return {'run_id': self.datasaver.run_id}
+
+    def samples_filename(self):
+        # the database can not hold a second table per run, so the samples are written next to it
+        path = self.datasaver.dataset.path_to_db
+        if not path or path == ':memory:':
+            return None
+        return os.path.splitext(path)[0]+'_run'+str(self.datasaver.run_id)+'_samples.txt'
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.runner.__exit__(exc_type, exc_val, exc_tb)
+        # also when the measurement crashed, the points that were measured should end up in the dataset
+        try:
+            self.flush()
+        finally:
+            self.runner.__exit__(exc_type, exc_val, exc_tb)
 
     def add_to_line(self, line):
-        newline = []
-        for entry in line:
-            if entry[0] not in STUPIDAXES:
-                newline.append(entry)
-        self.datasaver.add_result(*newline)
+        # keep the order of the data when rows are still waiting
+        self.flush()
+        self.datasaver.add_result(*line)
+
+    def add_row(self, row):
+        if self.batch_size is None:
+            self.datasaver.add_result(*[(name, row[i]) for i, name in self.row_slots])
+        else:
+            self.batch.append([row[i] for i, _ in self.row_slots])
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        # commit all rows that are waiting in the batch to the dataset
+        if not self.batch:
+            return
+        batch = self.batch
+        self.batch = []
+        names = [name for _, name in self.row_slots]
+        if self.batch_arrays:
+            self.datasaver.add_result(*[(name, np.array(column)) for name, column in zip(names, zip(*batch))])
+        else:
+            for row in batch:
+                self.datasaver.add_result(*zip(names, row))
 
     def write_line(self):
         pass
 
     def write_block(self):
-        pass
+        self.flush()
 
 # this databackend exists to circumentvent the fact that qcodes only allows a single shape per add_result
 class CutDataBackend(DataBackend):
     def __init__(self, meas):
         super().__init__(meas)
         self.all_deps = {}
+        self.write_plan = None
 
-    def setup(self, paramstructure):
-        super().setup(paramstructure)
-        # here I can extract some information regarding independents and such...
-
+    def setup(self, paramstructure, dict_waterfall):
+        super().setup(paramstructure, dict_waterfall)
+        # every dependent is written together with the independents it depends on. Dependents that depend on the
+        # same independents have the same shape, so they are written in a single add_result. The plan is compiled
+        # once: for every add_result the (name, slot) of all its columns
+        self.all_deps = {}
+        groups = {}  # slots of the independents -> [(name, slot), ...] of the dependents
         setpoints = []
-        print([p.independent for p in paramstructure])
-        for param in paramstructure:
-            if param.name in STUPIDAXES:
-                continue
+        latest = {}  # name -> slot of the last column with that name, independents are taken from there
+        written = set()
+        for slot, param in enumerate(paramstructure):
+            latest[param.name] = slot
             if param.independent:
-                if not param.independent == 2:
+                # trivial measurement axes are not registered, see DataBackend.setup
+                if isinstance(param, base.DataParameterFixedSweep) and param.npoints == 1:
+                    written.add(slot)
+                elif not param.independent == 2:
                     setpoints.append(param.name)
             else:
                 self.all_deps[param.name] = setpoints+param.extra_dependencies
+                # an independent that is also an extra dependency is written once
+                independents = tuple(dict.fromkeys(latest[name] for name in self.all_deps[param.name]))
+                groups.setdefault(independents, []).append((param.name, slot))
+                written.update(independents)
+                written.add(slot)
+
+        self.write_plan = []
+        for independents, dependents in groups.items():
+            self.write_plan.append([(paramstructure[slot].name, slot) for slot in independents]+dependents)
+
+        # check that all values are written somewhere
+        for slot, param in enumerate(paramstructure):
+            if slot not in written:
+                raise RuntimeError('Datacolumn '+param.name+'_'+str(slot)+' is not written together with any '
+                                   'dependent. I rather crash than lose data.')
+
+    def add_row(self, row):
+        for plan in self.write_plan:
+            self.datasaver.add_result(*[(name, row[slot]) for name, slot in plan])
 
     def add_to_line(self, line):
-        # the hard thing is to determine which parameters i should keep, which to remove and when to write
-        data = {}
-        # implement a stupid check to see that all parameters are written in the end
-        param_check = [False]*len(line)
-        print(self.all_deps)
-        for i, entry in enumerate(line):
-            if entry[0] in STUPIDAXES:
-                continue
-            # keep running tally of all columns, allows fancy overwriting if necessary
-            data[entry[0]] = (i, entry[1])
-            # if it is a pure dependent, write it, together with all its independents
-            if entry[0] in self.all_deps:
-                # when I write a line, keep a check which columns I use for that
-                newline = []
-                for indep in self.all_deps[entry[0]]:
-                    newline.append((indep, data[indep][1]))
-                    param_check[data[indep][0]] = True
-                newline.append((entry[0], entry[1]))
-                param_check[i] = True
-                self.datasaver.add_result(*newline)
-
-        # check that all values in the line are written somewhere
-        for i, written in enumerate(param_check):
-            if not written and line[i][0] not in STUPIDAXES:
-                raise RuntimeError('I dont know what went wrong, but datacolumn was not written. I rather crash than lose data. Datacolumn: '+ line[i][0]+'_'+str(i))
+        # the line holds the values of all columns in the order of the paramstructure
+        self.add_row([entry[1] for entry in line])
 
 
 class PysweepMetadata(qcodes.utils.metadata.Metadatable):
     def __init__(self):
         super().__init__()
         self.datashapes = {}
+        self.serpentine = []
+        self.resumed_from = None  # run id of the run that a resumed measurement continues
 
     def snapshot_base(self, update: bool = False,
                       params_to_skip_update: Optional[Sequence[str]] = None):
-        return {'datashapes': self.datashapes}
+        return {'datashapes': self.datashapes, 'serpentine': self.serpentine, 'resumed_from': self.resumed_from}
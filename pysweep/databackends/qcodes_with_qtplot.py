@@ -1,6 +1,9 @@
 import numpy as np
 import time
 import os
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
 
 try:
     import ipywidgets as ipw
@@ -21,25 +24,190 @@ import pysweep.databackends.qcodes as qcodes_backend
 '''
 A subclassed qcodes DataBackend, that makes live plots
 of 1D and 2D data.
-For higher dimentionality use ordinary qcodes DataBackend.
+Measurements with more sweeps are plotted as a 2D slice through
+the N-dimensional data, by default the slice that is being measured.
+1D traces that are longer than the plot is wide are plotted as a
+min/max decimation of the trace, such that a redraw takes the same
+time however long the trace is.
 '''
 
 
+def grid_position(flat, shape, serpentine):
+    '''
+    Position on the grid of the point (or line) with number flat in the order it is measured,
+    taking the reversed passes of serpentine sweeps into account
+
+    :param flat: number of the point in the order it is measured
+    :param shape: number of points of every sweep, outermost first
+    :param serpentine: for every sweep, whether it is a serpentine sweep
+    :return: tuple with the index along every sweep
+    '''
+    index = [int(i) for i in np.unravel_index(flat, shape)]
+    passes = 0
+    for i, size in enumerate(shape):
+        loop_index = index[i]
+        if serpentine[i] and passes % 2:
+            index[i] = size - 1 - loop_index
+        passes = passes*size + loop_index
+    return tuple(index)
+
+
+class MinMaxPyramid:
+    def __init__(self, x, y, bins):
+        '''
+        Min/max decimation of a trace at several resolutions. Level k holds the minimum and
+        maximum of every 2**k points of the trace, the coarsest level has at most bins bins
+        and is the one that is plotted, as the minimum and the maximum of every bin.
+        The finer levels make an update of a few points cost log(len(y)) instead of len(y).
+
+        :param x: the x values of the trace
+        :param y: the trace, read again at every update
+        :param bins: maximum number of bins of the plotted level, about the width of the plot in pixels
+        '''
+        self.y = y
+        self.levels = []  # (minima, maxima) of every level, from fine to coarse
+        size = len(y)
+        while size > bins:
+            size = (size+1)//2
+            self.levels.append((np.full(size, np.nan), np.full(size, np.nan)))
+        # every bin is drawn as a vertical line from its minimum to its maximum at its first x value
+        step = 2**len(self.levels)
+        self.x_plot = np.repeat(np.asarray(x, dtype=float)[::step], 2)
+        self.y_plot = np.full(len(self.x_plot), np.nan)
+        self.update(0, len(y))
+
+    def update(self, start, stop):
+        # recompute the bins of all levels that contain the points start to stop of the trace
+        stop = min(stop, len(self.y))
+        if start >= stop:
+            return
+        lower = upper = self.y
+        for minima, maxima in self.levels:
+            first, last = 2*(start//2), min(2*((stop+1)//2), len(lower))
+            start, stop = start//2, (stop+1)//2
+            pairs_lower, pairs_upper = lower[first:last], upper[first:last]
+            if (last-first) % 2:
+                pairs_lower = np.append(pairs_lower, np.nan)
+                pairs_upper = np.append(pairs_upper, np.nan)
+            # fmin and fmax ignore the NaN of points that are not measured yet
+            minima[start:stop] = np.fmin(pairs_lower[0::2], pairs_lower[1::2])
+            maxima[start:stop] = np.fmax(pairs_upper[0::2], pairs_upper[1::2])
+            lower, upper = minima, maxima
+        self.y_plot[2*start:2*stop:2] = lower[start:stop]
+        self.y_plot[2*start+1:2*stop:2] = upper[start:stop]
+
+
+def live_plot_process(plots, sequence, written, commands, plotting_interval):
+    '''
+    Runs the live plots in a separate process. The data of the plots lives in shared memory
+    that the measurement writes to, the measurement increments sequence after every point.
+    The plots are only redrawn when sequence changed, at most every plotting_interval seconds.
+
+    :param plots: for every plot the arguments of QtPlot and of QtPlot.add, where the arrays are
+        replaced by (name, shape, dtype) of their shared memory, and for decimated 1D plots the
+        number of bins and whether the points of the trace arrive one by one
+    :param sequence: shared counter that the measurement increments whenever the plots have to be redrawn
+    :param written: shared index of the point after the last written point, the points before it can be
+        added to the pyramids of the 1D plots whose points arrive one by one
+    :param commands: queue with ('title', (plot index, title)), ('finish', (png filenames, close)) and
+        ('stop', None) commands. When the plots are not closed at 'finish', they are redrawn when sequence
+        changes until all windows are closed or 'stop' arrives
+    :param plotting_interval: seconds between redraws
+    '''
+    memories = []
+    windows = []
+    pyramids = []  # (MinMaxPyramid, whether the points arrive one by one) of every decimated plot
+    for plot in plots:
+        add = dict(plot['add'])
+        for key, value in plot['add'].items():
+            if isinstance(value, SharedArray):
+                memory = shared_memory.SharedMemory(name=value.name)
+                memories.append(memory)
+                add[key] = np.ndarray(value.shape, dtype=value.dtype, buffer=memory.buf)
+        if plot.get('decimate') is not None:
+            pyramid = MinMaxPyramid(add['x'], add['y'], plot['decimate']['bins'])
+            pyramids.append((pyramid, plot['decimate']['incremental']))
+            add['x'], add['y'] = pyramid.x_plot, pyramid.y_plot
+        window = QtPlot(**plot['window'])
+        window.add(**add)
+        windows.append(window)
+
+    drawn = 0
+    pyramid_points = 0  # the points that the incremental pyramids contain
+    finished = False
+    while True:
+        try:
+            command, args = commands.get(timeout=plotting_interval)
+        except queue.Empty:
+            command, args = None, None
+        if command == 'stop':
+            break
+        if sequence.value != drawn or command == 'finish':
+            # the points of a 1D sweep arrive in order, only the new ones are added to the pyramid.
+            # At 'finish' the pyramids are rebuilt, such that the final plot never depends on the increments
+            drawn = sequence.value
+            previous, pyramid_points = pyramid_points, written.value
+            for pyramid, incremental in pyramids:
+                if incremental and previous <= pyramid_points and command != 'finish':
+                    pyramid.update(previous, pyramid_points)
+                else:
+                    pyramid.update(0, len(pyramid.y))
+            for window in windows:
+                window.update_plot()
+        if command == 'title':
+            i, title = args
+            windows[i].subplots[0].setTitle(title, size='7pt', color='000000')
+        elif command == 'finish':
+            filenames, close = args
+            for window, filename in zip(windows, filenames):
+                if filename is not None:
+                    window.save(filename=filename)
+                if close:
+                    window.win.close()
+            if close:
+                break
+            finished = True
+        # after the measurement the windows stay open until the user closes them
+        if finished and not any(window_is_open(window) for window in windows):
+            break
+    # the shared memory is released when this process ends, the measurement process unlinks it
+
+
+def window_is_open(window):
+    try:
+        return window.win.isVisible()
+    except Exception:
+        # the window, or the process that shows it, is gone
+        return False
+
+
+class SharedArray:
+    # describes an array in shared memory such that another process can attach to it
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
 class DataBackend(qcodes_backend.DataBackend):
     def __init__(self, experiment_name, sample, station,
                     plotting_interval: float=3,
                     export_png=True,
                     progress_bar=False,
-                    close_when_finished=False):
+                    close_when_finished=False,
+                    batch_size=None,
+                    slice_index=None,
+                    snapshot_cache=None,
+                    decimate=True):
         '''
         This is a PycQED-inspired subclass of qcodes data backend
         that adds 1D and 2D live plotting functionality.
 
-        The backend uses QtPlot from QCoDeS for live plotting. Since plotting
-        runs in the same thread as the measurement it introduces an overhead
-        that comes from opening of the windows with plots and updating them.
-        With plotting_interval=3 (seconds) overhead in measurement
-        is relatively small (~10%).
+        The backend uses QtPlot from QCoDeS for live plotting. The plots
+        run in a separate process that reads the plotted data from shared
+        memory, so the measurement only writes the values and increments a
+        counter. The plot process redraws at most every plotting_interval
+        seconds, and only when new data arrived.
 
         The backend has an option of outputting a PNG image at the end
         of the measurement. The figures are saved in subdirectories
@@ -49,24 +217,57 @@ class DataBackend(qcodes_backend.DataBackend):
         which database the data was saved in and where in the database
         the data is saved.
 
-        At this time only 1D and 2D datasets and only point-by-point
-        measurements are supported. 2D datasets will show correctly
-        only if they are on a regular grid.
-        Increasing generality is on TODO list.
+        Unless close_when_finished is set, the plots stay open after
+        the measurement, until their windows are closed, close_plots is
+        called or the backend is set up for the next measurement.
+
+        Measurements with more sweeps than a plot has axes are shown
+        as a 2D slice: the plot keeps the full N-dimensional grid and
+        shows the slice along the two innermost sweeps (the innermost
+        sweep for array data) at the position of the outer sweeps given
+        by slice_index. The slice can be changed with show_slice during
+        the measurement, and after it as long as the plots are open.
+        Data will show correctly only if it is on a regular grid.
+
+        batch_size and snapshot_cache are passed on to the qcodes
+        DataBackend, see there.
+
+        :param slice_index: index along the outer sweeps, outermost first,
+            of the slice to show. Sweeps that are not given follow the
+            point that is being measured, None shows the slice that is
+            being measured.
+        :param decimate: plot 1D traces that have more points than the
+            plot is wide in pixels as the minimum and maximum of every
+            pixel, see MinMaxPyramid. The data in the dataset is not
+            decimated.
         '''
 
         self.plotting_interval = plotting_interval
         self.export_png = export_png
         self.progress_bar = progress_bar
         self.close_when_finished = close_when_finished
+        self.slice_index = tuple(slice_index or ())
+        self.decimate = decimate
+
+        self.shared_arrays = {}  # id of the array -> SharedArray, for all plotted arrays
+        self.shared_memories = []
+        self.quantities = []
+        self.plot_process = None
+        self.plot_commands = None
+        self.sequence = None
+        self.written = None
+        self.resume_state = None
 
         self.experiment = select_experiment(experiment_name, sample)
         measurement = Measurement(self.experiment, station)
 
-        super().__init__(measurement)
+        super().__init__(measurement, batch_size=batch_size, snapshot_cache=snapshot_cache)
 
     def setup(self, paramstructure, dict_waterfall):
+        # the plots of the previous measurement make way for the new ones
+        self.close_plots()
         super().setup(paramstructure, dict_waterfall)
+        self.resume_state = None
         
         # distinguish between independent and dependent parameters
         # (coordinates and quantities, respectively)
@@ -77,22 +278,18 @@ class DataBackend(qcodes_backend.DataBackend):
         parameter_index = 0
         for param in paramstructure:
             if isinstance(param, DataParameterFixedAxis):
-                if ('None' in param.name) and (param.unit is 'e'):
-                    parameter_index += 1
-                    continue
                 self.hard_sweeped_coordinates.append({'name': param.name,
                                                  'unit': param.unit,
                                                  'coordinates': param.coordinates,
                                                  'independent': param.independent})
             elif isinstance(param, DataParameterFixedSweep):
-                if ('None' in param.name) and (param.unit is 'e'):
-                    parameter_index += 1
-                    continue
                 self.soft_sweeped_coordinates.append({'name': param.name,
+                                                 'index': parameter_index,
                                                  'unit': param.unit,
                                                  'start': param.start,
                                                  'end': param.stop,
                                                  'size': param.npoints,
+                                                 'serpentine': param.serpentine,
                                                  'independent': param.independent})
             else:
                 self.quantities.append({'name': param.name,
@@ -110,6 +307,7 @@ class DataBackend(qcodes_backend.DataBackend):
         self.hard_sweeped_coordinates.reverse()
 
         self.create_plots()
+        self.compile_updates()
 
         if self.progress_bar:
             self.create_progress_bar()
@@ -135,8 +333,7 @@ class DataBackend(qcodes_backend.DataBackend):
             title_list.append(timestamp)
 
             plot_title = ', '.join(title_list)
-            quantity['plot'].subplots[0].setTitle(plot_title,
-                            size='7pt',color='000000')
+            self.plot_commands.put(('title', (i, plot_title)))
 
         # create a directory for figures
         if self.export_png:
@@ -160,6 +357,16 @@ class DataBackend(qcodes_backend.DataBackend):
         # a counter used to select where the new data point
         # should be inserted
         self.point_counter = 0
+        # the lines of 2D maps are collected in line_buffer and written to the plots per line
+        self.line_length = 0
+        self.lines_written = 0
+        # a resumed measurement continues to plot where the checkpoint was written,
+        # the points before it are in the dataset of the checkpoint, not in these plots
+        if self.resume_state is not None:
+            self.point_counter = self.resume_state['point_counter']
+            self.lines_written = self.resume_state['lines_written']
+        if self.written is not None:
+            self.written.value = self.point_counter
         # initialize timer for live update
         self.last_update_time = time.time()
 
@@ -167,65 +374,214 @@ class DataBackend(qcodes_backend.DataBackend):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         super().__exit__(exc_type, exc_val, exc_tb)
+        # also show the line that was measured when the measurement stopped
+        self.write_staged_line()
 
-        # at the end update the plots for the last time
-        # and export figures
-        for qi, quantity in enumerate(self.quantities):
-            quantity['plot'].update_plot()
-            if self.progress_bar:
-                self.update_progress_bar()
+        if self.progress_bar:
+            self.update_progress_bar()
 
+        # at the end the plot process updates the plots for the last time
+        # and exports figures
+        filenames = []
+        for qi, quantity in enumerate(self.quantities):
             if self.export_png:
                 run_id = self.runner.ds.run_id
-                filename = '/'.join([self.directory_prefix,
-                                str(run_id)+'_'+self.time+'_'+quantity['name']+'.png'])
-                quantity['plot'].save(filename=filename)
+                filenames.append('/'.join([self.directory_prefix,
+                                str(run_id)+'_'+self.time+'_'+quantity['name']+'.png']))
+            else:
+                filenames.append(None)
+        self.plot_commands.put(('finish', (filenames, self.close_when_finished)))
+        if self.close_when_finished:
+            self.close_plots()
 
-            if self.close_when_finished:
-                quantity['plot'].win.close()
-                del quantity['plot']
+    def close_plots(self):
+        '''
+        Close the plot windows and release the shared memory of the plots.
+        The data of the plots stays available in self.quantities, as
+        private copies.
+        '''
+        if self.plot_process is not None:
+            if self.plot_process.is_alive():
+                self.plot_commands.put(('stop', None))
+            self.plot_process.join()
+            self.plot_process = None
+
+        # the views on the shared memory would point to released memory once it is closed,
+        # so everything that refers to them gets a copy
+        for quantity in self.quantities:
+            for key in ('xvals', 'yvals', 'zvals'):
+                if key in quantity:
+                    quantity[key] = np.array(quantity[key])
+            add = quantity['plot']['add']
+            for key, value in add.items():
+                if isinstance(value, np.ndarray) and id(value) in self.shared_arrays:
+                    add[key] = np.array(value)
+        self.point_updates = []
+
+        for memory in self.shared_memories:
+            memory.close()
+            try:
+                memory.unlink()
+            except FileNotFoundError:
+                pass
+        self.shared_memories = []
+        self.shared_arrays = {}
+
+    def resume(self, state):
+        super().resume(state)
+        self.resume_state = state
 
+    def checkpoint(self):
+        # checkpoints are written after a block, so the staged line is written already
+        state = super().checkpoint()
+        state.update(point_counter=self.point_counter, lines_written=self.lines_written)
+        return state
 
     def add_to_line(self, line):
-        super().add_to_line(line)       
+        self.add_row([entry[1] for entry in line])
 
-        for qi, quantity in enumerate(self.quantities):
-            # case for the measured data that is returned point-by-point
+    def add_row(self, row):
+        super().add_row(row)
+
+        for update in self.point_updates:
+            update(row)
+        if self.staged_slots and self.line_length < len(self.line_buffer):
+            self.line_buffer[self.line_length] = [row[i] for i in self.staged_slots]
+            self.line_length += 1
+
+        self.point_counter += 1
+        # the plot process redraws when it sees the counter change
+        self.written.value = self.point_counter
+        self.sequence.value += 1
+        if self.progress_bar and time.time()-self.last_update_time > self.plotting_interval:
+            self.update_progress_bar()
+            self.last_update_time = time.time()
+
+    def skip_points(self, n):
+        # points that a ThreadedDataBackend did not hand over stay NaN in the plots
+        if self.staged_slots and self.line_length < len(self.line_buffer):
+            end = min(self.line_length+n, len(self.line_buffer))
+            self.line_buffer[self.line_length:end] = np.nan
+            self.line_length = end
+        self.point_counter += n
+        if self.written is not None:
+            self.written.value = self.point_counter
+
+    def write_block(self):
+        super().write_block()
+        self.write_staged_line()
+
+    def write_staged_line(self):
+        # write the collected line of every 2D map with a single slice assignment
+        n = self.line_length
+        if not n:
+            return
+        line = self.lines_written
+        self.line_length = 0
+        self.lines_written += 1
+        if line >= self.lines_total:
+            return
+        *outer, y_index = grid_position(line, self.line_shape, self.line_serpentine)
+        outer = tuple(outer)
+        coordinate = self.soft_sweeped_coordinates[0]
+        # every odd line of a serpentine sweep runs backwards
+        if coordinate['serpentine'] and line % 2:
+            values = self.line_buffer[n-1::-1]
+            columns = slice(coordinate['size']-n, coordinate['size'])
+        else:
+            values = self.line_buffer[:n]
+            columns = slice(0, n)
+        for j, quantity in enumerate(self.staged):
+            if 'grid' in quantity:
+                quantity['grid'][outer+(y_index, columns)] = values[:, j]
+                if not self.select_slice(quantity, outer):
+                    continue
+            quantity['zvals'][y_index, columns] = values[:, j]
+
+    def select_slice(self, quantity, outer):
+        '''
+        Keep the plot of an N-dimensional quantity on the slice that should be shown
+
+        :param quantity: the quantity, with the full data in quantity['grid']
+        :param outer: index along the outer sweeps of the slice that is being measured
+        :return: whether the slice that is being measured is shown
+        '''
+        quantity['measured'] = outer
+        # the sweeps given in slice_index are fixed, the others follow the measurement
+        shown = self.slice_index[:len(outer)] + outer[len(self.slice_index):]
+        if shown != quantity['shown']:
+            quantity['shown'] = shown
+            quantity['zvals'][...] = quantity['grid'][shown]
+        return shown == outer
+
+    def show_slice(self, slice_index=None):
+        '''
+        Change the slice of the plots of N-dimensional measurements
+
+        :param slice_index: index along the outer sweeps, outermost first, see the
+            constructor. None shows the slice that is being measured
+        '''
+        if self.plot_process is None or not self.plot_process.is_alive():
+            raise RuntimeError('The plots of this measurement are closed, '
+                               'show_slice can only change plots that are open')
+        self.slice_index = tuple(slice_index or ())
+        for quantity in self.quantities:
+            if 'grid' in quantity:
+                self.select_slice(quantity, quantity['measured'])
+        # make the plot process redraw
+        if self.sequence is not None:
+            self.sequence.value += 1
+
+    def compile_updates(self):
+        # decide once for every quantity how its plot data is updated, such that add_row does not have to
+        # figure that out again for every point. 2D maps of numeric values are staged in line_buffer and written
+        # per line at write_block, the other plots are updated at every point
+        self.point_updates = []
+        self.staged = []
+        for quantity in self.quantities:
+            index = quantity['index']
             if quantity['type'] == 'numeric':
                 # 1D measurement
                 if len(self.soft_sweeped_coordinates) == 1:
-                    quantity['xvals'][self.point_counter] = line[2][1]
-                    quantity['yvals'][self.point_counter] = line[quantity['index']][1]
-                elif len(self.soft_sweeped_coordinates) == 2:
-                    x_index = self.point_counter % self.soft_sweeped_coordinates[0]['size']
-                    y_index = int((self.point_counter - x_index)/self.soft_sweeped_coordinates[0]['size'])
-
-                    # commented out because I can't get the irregular grid
-                    # to work [FKM], TODO
-                    # quantity['xvals'][y_index] = line[1][1]
-                    # quantity['yvals'][x_index] = line[2][1]
-                    quantity['zvals'][y_index,x_index] = line[quantity['index']][1]
-            # case for the measured data that is returned line-by-line
-            elif quantity['type'] == 'array':
+                    def update(row, xvals=quantity['xvals'], yvals=quantity['yvals'], index=index,
+                               x_index=self.soft_sweeped_coordinates[0]['index']):
+                        xvals[self.point_counter] = row[x_index]
+                        yvals[self.point_counter] = row[index]
+                # 2D measurement
+                else:
+                    self.staged.append(quantity)
+                    continue
+            else:
                 # 1D measurement
                 if len(self.soft_sweeped_coordinates) == 0:
-                    quantity['yvals'][:] = line[quantity['index']][1][:]
+                    def update(row, yvals=quantity['yvals'], index=index):
+                        yvals[:] = row[index]
                 # 2D measurement
                 elif len(self.soft_sweeped_coordinates) == 1:
-                    quantity['zvals'][:,self.point_counter] = line[quantity['index']][1][:]
-            else:
-                raise NotImplementedError('qcodes_with_qtplot only supports plotting 1D and 2D data')
-        
-        # update plot only every several (self.plotting_interval)
-        # seconds to minimize the overhead
-        if time.time()-self.last_update_time > self.plotting_interval:
-            for qi, quantity in enumerate(self.quantities):
-                quantity['plot'].update_plot()
-            if self.progress_bar:
-                self.update_progress_bar()
-            self.last_update_time = time.time()
-
-        self.point_counter += 1
+                    def update(row, zvals=quantity['zvals'], index=index):
+                        zvals[:, self.point_counter] = row[index]
+                # N-dimensional measurement, of which a 2D slice is shown
+                else:
+                    def update(row, quantity=quantity, index=index,
+                               shape=[c['size'] for c in reversed(self.soft_sweeped_coordinates)],
+                               serpentine=[c['serpentine'] for c in reversed(self.soft_sweeped_coordinates)]):
+                        if self.point_counter >= quantity['grid_points']:
+                            return
+                        *outer, x_index = grid_position(self.point_counter, shape, serpentine)
+                        outer = tuple(outer)
+                        quantity['grid'][outer][:, x_index] = row[index]
+                        if self.select_slice(quantity, outer):
+                            quantity['zvals'][:, x_index] = row[index]
+            self.point_updates.append(update)
+
+        self.staged_slots = [quantity['index'] for quantity in self.staged]
+        # the lines of the 2D maps are numbered over all sweeps but the innermost, outermost first
+        self.line_shape = [c['size'] for c in reversed(self.soft_sweeped_coordinates[1:])]
+        self.line_serpentine = [c['serpentine'] for c in reversed(self.soft_sweeped_coordinates[1:])]
+        self.lines_total = int(np.prod(self.line_shape))
+        self.line_buffer = None
+        if self.staged:
+            self.line_buffer = np.full((self.soft_sweeped_coordinates[0]['size'], len(self.staged)), np.nan)
 
     def create_plots(self):
         # open each measured quantity in a separate window
@@ -235,10 +591,10 @@ class DataBackend(qcodes_backend.DataBackend):
         # print(self.quantities)
         # print(self.soft_sweeped_coordinates)
         for i, quantity in enumerate(self.quantities):
-            quantity['plot'] = QtPlot(window_title=quantity['name'],
+            quantity['plot'] = {'window': dict(window_title=quantity['name'],
                         figsize=(550, 300),
                         fig_x_position=int(i/3)*0.3,
-                        fig_y_position=(i%3)*0.315)
+                        fig_y_position=(i%3)*0.315)}
 
             # case for the measured data that is returned point-by-point
             if quantity['type'] == 'numeric':
@@ -246,36 +602,37 @@ class DataBackend(qcodes_backend.DataBackend):
                 if len(self.soft_sweeped_coordinates) == 1:
                     coordinate = self.soft_sweeped_coordinates[0]
 
-                    quantity['xvals'] = np.linspace(coordinate['start'],
+                    quantity['xvals'] = self.shared_array(np.linspace(coordinate['start'],
                                         coordinate['end'],
-                                        coordinate['size'])
-                    quantity['yvals'] = np.ones(coordinate['size'])
-                    quantity['yvals'][:] = np.NaN
+                                        coordinate['size']))
+                    quantity['yvals'] = self.shared_array(np.full(coordinate['size'], np.nan))
 
-                    quantity['plot'].add(x=quantity['xvals'],
+                    quantity['plot']['add'] = dict(x=quantity['xvals'],
                                          y=quantity['yvals'],
                                          xlabel=coordinate['name'],
                                          xunit=coordinate['unit'],
                                          ylabel=quantity['name'],
                                          yunit=quantity['unit'])
+                    # the points arrive one by one
+                    self.set_decimation(quantity, incremental=True)
 
-                # 2D measurement
-                elif len(self.soft_sweeped_coordinates) == 2:
+                # 2D measurement, or a 2D slice of an N-dimensional measurement
+                elif len(self.soft_sweeped_coordinates) >= 2:
                     coordinateX = self.soft_sweeped_coordinates[0]
                     coordinateY = self.soft_sweeped_coordinates[1]
 
-                    quantity['xvals'] = np.linspace(coordinateX['start'],
+                    quantity['xvals'] = self.shared_array(np.linspace(coordinateX['start'],
                                         coordinateX['end'],
-                                        coordinateX['size'])
-                    quantity['yvals'] = np.linspace(coordinateY['start'],
+                                        coordinateX['size']))
+                    quantity['yvals'] = self.shared_array(np.linspace(coordinateY['start'],
                                         coordinateY['end'],
-                                        coordinateY['size'])
+                                        coordinateY['size']))
 
-                    quantity['zvals'] = np.ones([coordinateY['size'],
-                                                 coordinateX['size']])
-                    quantity['zvals'][:,:] = np.NaN
+                    quantity['zvals'] = self.shared_array(np.full([coordinateY['size'],
+                                                 coordinateX['size']], np.nan))
+                    self.create_grid(quantity, self.soft_sweeped_coordinates[2:])
 
-                    quantity['plot'].add(x=quantity['xvals'],
+                    quantity['plot']['add'] = dict(x=quantity['xvals'],
                                          y=quantity['yvals'],
                                          z=quantity['zvals'],
                                          xlabel=coordinateX['name'],
@@ -285,8 +642,8 @@ class DataBackend(qcodes_backend.DataBackend):
                                          zlabel=quantity['name'],
                                          zunit=quantity['unit'])
                 else:
-                    raise NotImplementedError('qcodes_with_qtplot only'
-                                'supports plotting 1D and 2D data')
+                    raise NotImplementedError('qcodes_with_qtplot can not '
+                                'plot a measurement without sweeps')
 
             # case for the measured data that is returned line-by-line
             elif quantity['type'] == 'array':
@@ -303,18 +660,19 @@ class DataBackend(qcodes_backend.DataBackend):
                             if coordinate['name'] == quantity['extra_dependencies'][0]:
                                 break
 
-                    quantity['xvals'] = coordinate['coordinates']
-                    quantity['yvals'] = np.ones(coordinate['coordinates'].shape)
-                    quantity['yvals'][:] = np.NaN
+                    quantity['xvals'] = self.shared_array(coordinate['coordinates'])
+                    quantity['yvals'] = self.shared_array(np.full(np.shape(coordinate['coordinates']), np.nan))
 
-                    quantity['plot'].add(x=quantity['xvals'],
+                    quantity['plot']['add'] = dict(x=quantity['xvals'],
                                          y=quantity['yvals'],
                                          xlabel=coordinate['name'],
                                          xunit=coordinate['unit'],
                                          ylabel=quantity['name'],
                                          yunit=quantity['unit'])
-                # 2D measurement
-                elif len(self.soft_sweeped_coordinates) == 1:
+                    # the whole trace is replaced at every point
+                    self.set_decimation(quantity, incremental=False)
+                # 2D measurement, or a 2D slice of an N-dimensional measurement
+                elif len(self.soft_sweeped_coordinates) >= 1:
                     coordinateX = self.soft_sweeped_coordinates[0]
                     # check if you should use the default dependency
                     # on hard_sweeped coordinate, otherwise find a hard_sweeped
@@ -326,16 +684,16 @@ class DataBackend(qcodes_backend.DataBackend):
                             if coordinateY['name'] == quantity['extra_dependencies'][0]:
                                 break
 
-                    quantity['xvals'] = np.linspace(coordinateX['start'],
+                    quantity['xvals'] = self.shared_array(np.linspace(coordinateX['start'],
                                         coordinateX['end'],
-                                        coordinateX['size'])
-                    quantity['yvals'] = coordinateY['coordinates']
+                                        coordinateX['size']))
+                    quantity['yvals'] = self.shared_array(coordinateY['coordinates'])
 
-                    quantity['zvals'] = np.ones([coordinateY['coordinates'].shape[0],
-                                                 coordinateX['size']])
-                    quantity['zvals'][:,:] = np.NaN
+                    quantity['zvals'] = self.shared_array(np.full([len(coordinateY['coordinates']),
+                                                 coordinateX['size']], np.nan))
+                    self.create_grid(quantity, self.soft_sweeped_coordinates[1:])
 
-                    quantity['plot'].add(x=quantity['xvals'],
+                    quantity['plot']['add'] = dict(x=quantity['xvals'],
                                          y=quantity['yvals'],
                                          z=quantity['zvals'],
                                          xlabel=coordinateX['name'],
@@ -344,20 +702,60 @@ class DataBackend(qcodes_backend.DataBackend):
                                          yunit=coordinateY['unit'],
                                          zlabel=quantity['name'],
                                          zunit=quantity['unit'])
-                else:
-                    raise NotImplementedError('qcodes_with_qtplot only'
-                                'supports plotting 1D and 2D data')
-                    
+
             else:
                 raise NotImplementedError('Unsupported type of data.'
                                     ' Must be "numeric" of "array".')
 
+        self.start_plot_process()
+
+    def set_decimation(self, quantity, incremental):
+        # a 1D trace with more points than the plot has pixels is decimated by the plot process
+        bins = quantity['plot']['window']['figsize'][0]
+        if self.decimate and len(quantity['yvals']) > bins:
+            quantity['plot']['decimate'] = {'bins': bins, 'incremental': incremental}
+
+    def create_grid(self, quantity, outer_coordinates):
+        # the full data of an N-dimensional quantity, zvals shows a slice of it.
+        # It is only written by this process, so it does not have to be shared
+        if not outer_coordinates:
+            return
+        outer_shape = [coordinate['size'] for coordinate in reversed(outer_coordinates)]
+        quantity['grid'] = np.full(outer_shape+list(quantity['zvals'].shape), np.nan)
+        quantity['grid_points'] = int(np.prod(outer_shape))*quantity['zvals'].shape[-1]
+        quantity['measured'] = (0,)*len(outer_shape)
+        quantity['shown'] = None
+
+    def shared_array(self, values):
+        # copy values to an array in shared memory, the plot process sees every change made to it
+        values = np.asarray(values, dtype=float)
+        memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        array = np.ndarray(values.shape, dtype=values.dtype, buffer=memory.buf)
+        array[...] = values
+        self.shared_memories.append(memory)
+        self.shared_arrays[id(array)] = SharedArray(memory.name, values.shape, values.dtype.str)
+        return array
+
+    def start_plot_process(self):
+        plots = []
+        for quantity in self.quantities:
+            add = {key: self.shared_arrays.get(id(value), value) if isinstance(value, np.ndarray) else value
+                   for key, value in quantity['plot']['add'].items()}
+            plots.append({'window': quantity['plot']['window'], 'add': add,
+                          'decimate': quantity['plot'].get('decimate')})
+        # spawn a fresh process, forking would copy the state of qcodes and the database connection
+        context = multiprocessing.get_context('spawn')
+        self.sequence = context.RawValue('Q', 0)
+        self.written = context.RawValue('Q', 0)
+        self.plot_commands = context.Queue()
+        self.plot_process = context.Process(target=live_plot_process,
+                                            args=(plots, self.sequence, self.written, self.plot_commands,
+                                                  self.plotting_interval),
+                                            daemon=True)
+        self.plot_process.start()
+
     def create_progress_bar(self):
-        first_quantity = self.quantities[0]
-        if 'zvals' in first_quantity.keys():
-            total_datapoints = np.product(first_quantity['zvals'].shape)
-        else:
-            total_datapoints = first_quantity['yvals'].shape[0]
+        total_datapoints = int(np.prod([coordinate['size'] for coordinate in self.soft_sweeped_coordinates]))
         self.progress_bar = ipw.FloatProgress(value=0,
                                         min=0, max=total_datapoints,
                                         description='Progress:')
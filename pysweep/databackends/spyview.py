@@ -12,7 +12,26 @@ fmt = 'D:/Data/{date}/{date}_{counter}'
 
 
 class DataBackend(base.DataBackend, base.DataSaver):
-    def __init__(self):
+    def __init__(self, flush='block', snapshot_cache=None):
+        '''
+        Lines are collected in memory and written to the data file as a whole at the end of every innermost sweep
+
+        :param flush: when the data file is flushed to disk. 'block' (default) flushes after every innermost sweep,
+            a number flushes after an innermost sweep once that many seconds have passed since the previous flush,
+            and 'exit' only flushes when the measurement ends. Lines are only written at the end of an innermost
+            sweep, so also with a number the file is never flushed in the middle of one
+        :param snapshot_cache: a SnapshotCache (see pysweep.core.snapshots) of the station. The snapshot is then taken
+            in a worker thread while the measurement starts and written at the end of the first innermost sweep,
+            as the difference with the first snapshot of the cache. When None, pysweep.STATION.snapshot() is
+            written when the measurement starts
+        '''
+        if not (flush in ('block', 'exit') or isinstance(flush, (int, float))):
+            raise ValueError('flush should be \'block\', \'exit\' or a number of seconds, not '+repr(flush))
+        self.flush_policy = flush
+        self.last_flush = None
+        self.snapshot_cache = snapshot_cache
+        self.snapshot_pending = False
+
         self.io = qc.DiskIO('.')
         loc_provider = qc.data.location.FormatLocation(
             fmt=fmt)
@@ -22,6 +41,10 @@ class DataBackend(base.DataBackend, base.DataSaver):
         self.columns = None
         self.column_lookup = None
         self.line = None
+        self.block = None  # formatted lines of the current innermost sweep that are not written yet
+        self.serpentine = False  # is the innermost sweep a serpentine sweep, outer ones are not supported
+        self.blocks = 0
+        self.resume_state = None  # write position in the data file of a measurement that is resumed
 
 
     def setup(self, paramstructure, dict_waterfall):
@@ -47,6 +70,21 @@ class DataBackend(base.DataBackend, base.DataSaver):
                 self.columns.append({'name': name,
                                      'type': 'value'})
         self.line = [None]*len(self.columns)
+        self.block = []
+        sweeps = [param for param in paramstructure if isinstance(param, DataParameterFixedSweep)]
+        # the lines of the innermost sweep are turned around per block, the blocks of an outer serpentine sweep
+        # would have to be kept until its whole pass is measured
+        if any(param.serpentine for param in sweeps[:-1]):
+            raise Exception('spyview databackend only supports a serpentine order for the innermost sweep')
+        self.serpentine = bool(sweeps) and sweeps[-1].serpentine
+        self.blocks = 0
+        self.resume_state = None
+
+    def resume(self, state):
+        # continue in the data file of the checkpoint, the header and the other files are already written
+        self.resume_state = state
+        self.filename = state['filename']
+        self.blocks = state['blocks']
 
     def write_python(self, code_file):
         # Write function definitions to file
@@ -83,33 +121,85 @@ class DataBackend(base.DataBackend, base.DataSaver):
             del frame
 
     def __enter__(self):
+        if self.resume_state is not None:
+            self.runner = self.io.open(self.filename + '.dat', 'a')
+            self.file = self.runner.__enter__()
+            # lines that were written after the checkpoint are measured again
+            self.file.truncate(self.resume_state['position'])
+            self.last_flush = time.time()
+            return self
         self.runner = self.io.open(self.filename + '.dat', 'w')
         self.file = self.runner.__enter__()
         self.metafile = open(self.filename + '.meta.txt', 'w')
         self.write_header()
         self.metafile.close()
         # Save snapshot of the station
-        with open(str(self.filename) + '.json', 'w') as settings_file:
-            json.dump(pysweep.STATION.snapshot(), settings_file, indent=4)
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.start()
+            self.snapshot_pending = True
+        else:
+            with open(str(self.filename) + '.json', 'w') as settings_file:
+                json.dump(pysweep.STATION.snapshot(), settings_file, indent=4)
         with open(str(self.filename) + '.py', 'w') as code_file:
             self.write_python(code_file)
+        self.last_flush = time.time()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.runner.__exit__(exc_type, exc_val, exc_tb)
+        # lines of an unfinished innermost sweep (e.g. after a crash) still have to end up in the file,
+        # in the same order as those of a finished one
+        try:
+            self.write_rows(reverse=self.serpentine and self.blocks % 2)
+            self.file.flush()
+            self.write_snapshot()
+        finally:
+            self.runner.__exit__(exc_type, exc_val, exc_tb)
+
+    def write_snapshot(self):
+        # write the snapshot that the worker thread of the snapshot cache has taken
+        if self.snapshot_pending:
+            self.snapshot_pending = False
+            self.snapshot_cache.write(str(self.filename) + '.json', self.snapshot_cache.get_result())
 
     def add_to_line(self, columns):
         # update the self.line variable with the set of values that we are currently getting
         for column in columns:
             self.line[self.column_lookup[column[0]]] = column[1]
 
+    def add_row(self, row):
+        # the columns of this backend are ordered as the row, no lookup needed
+        self.line[:] = row
+
     def write_line(self):
-        self.file.write('\t'.join([str(v) for v in self.line]) + '\r\n')
-        self.file.flush()
+        self.block.append('\t'.join([str(v) for v in self.line]) + '\r\n')
 
     def write_block(self):
+        # spyview places lines on the grid in the order of the file,
+        # so the reversed passes of a serpentine sweep are written in the order of the grid
+        self.write_rows(reverse=self.serpentine and self.blocks % 2)
+        self.blocks += 1
         self.file.write('\r\n')
+        if self.snapshot_pending:
+            self.write_snapshot()
+        if self.flush_policy == 'block':
+            self.file.flush()
+            self.last_flush = time.time()
+        elif self.flush_policy != 'exit' and time.time() - self.last_flush > self.flush_policy:
+            self.file.flush()
+            self.last_flush = time.time()
+
+    def checkpoint(self):
         self.file.flush()
+        return {'filename': self.filename, 'position': self.file.tell(), 'blocks': self.blocks}
+
+    def samples_filename(self):
+        return str(self.filename) + '.samples.txt'
+
+    def write_rows(self, reverse=False):
+        # write all waiting lines at once
+        if self.block:
+            self.file.write(''.join(reversed(self.block) if reverse else self.block))
+            self.block = []
 
     def write_header(self):
         filename = self.filename.split("/")[-1]
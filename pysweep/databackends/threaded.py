@@ -0,0 +1,205 @@
+import queue
+import threading
+import warnings
+
+import pysweep.databackends.base as base
+
+'''
+A DataBackend that hands all data to another DataBackend from a separate writer thread.
+The measurement loop only puts the rows on a bounded queue, so writing to disk or to a database
+overlaps with setting the next setpoint.
+'''
+
+
+class ThreadedDataBackend(base.DataBackend, base.DataSaver):
+    def __init__(self, databackend, maxsize=1000, overflow='block', decimate=1, critical=True):
+        '''
+        Wrap a DataBackend such that its DataSaver runs in a writer thread
+
+        The wrapped DataBackend is entered and exited in the writer thread as well, so all its calls come from a
+        single thread (sqlite connections require this).
+
+        :param databackend: the DataBackend to write to
+        :param maxsize: maximum number of calls waiting in the queue, when the queue is full the measurement loop
+            waits for the writer thread (backpressure) instead of using more and more memory
+        :param overflow: 'block' (default) waits for the writer thread when the queue is full, 'drop' drops the
+            points that do not fit in the queue. Blocks are never dropped. Only use 'drop' for backends that do not
+            need every point, such as live plots
+        :param decimate: only every decimate-th point is handed to the wrapped backend, blocks are never skipped.
+            The wrapped backend is told how many points it did not get through DataSaver.skip_points, before the
+            next point or block it gets, such that backends that place points by counting them keep every point
+            in its place on the grid
+        :param critical: when False, an error of the wrapped backend is reported as a warning and the backend stops
+            receiving data, instead of stopping the measurement
+        '''
+        if overflow not in ('block', 'drop'):
+            raise ValueError('overflow should be \'block\' or \'drop\', not '+repr(overflow))
+        self.databackend = databackend
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.decimate = decimate
+        self.critical = critical
+        self.queue = None
+        self.thread = None
+        self.wrapped_datasaver = None
+        self.error = None  # exception raised in the writer thread
+        self.reported = False  # was the error of a non-critical backend reported
+        self.dropped = 0  # number of points that were dropped because the queue was full
+        self.points = 0  # number of points that were offered, used for decimation
+        self.skip_line = False  # the row of the current point was not put in the queue
+        self.skipped = 0  # number of points that were not put in the queue since the last point or block that was
+
+    def setup(self, paramstructure, dict_waterfall):
+        self.databackend.setup(paramstructure, dict_waterfall)
+
+    def resume(self, state):
+        self.databackend.resume(state)
+
+    def can_resume(self):
+        return self.databackend.can_resume()
+
+    def __enter__(self):
+        self.queue = queue.Queue(maxsize=self.maxsize)
+        self.error = None
+        self.reported = False
+        self.dropped = 0
+        self.points = 0
+        self.skip_line = False
+        self.skipped = 0
+        entered = threading.Event()
+        self.thread = threading.Thread(target=self._writer, args=(entered,), name='pysweep writer', daemon=True)
+        self.thread.start()
+        entered.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        # give access to the dataset of the wrapped qcodes backend, like the unwrapped backend does
+        if hasattr(self.wrapped_datasaver, 'datasaver'):
+            self.datasaver = self.wrapped_datasaver.datasaver
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the writer thread empties the queue before it exits the wrapped backend, also after a crash
+        self.queue.put(('exit', (exc_type, exc_val, exc_tb)))
+        self.thread.join()
+        if self.error is not None:
+            if self.critical and exc_type is None:
+                raise self.error
+            # the error of a failed measurement is raised, the error of the writer thread is reported along with it
+            self._report()
+
+    def _writer(self, entered):
+        try:
+            self.wrapped_datasaver = self.databackend.__enter__()
+        except BaseException as e:
+            self.error = e
+            return
+        finally:
+            entered.set()
+
+        while True:
+            call, args = self.queue.get()
+            if call == 'exit':
+                try:
+                    self.databackend.__exit__(*args)
+                except BaseException as e:
+                    if self.error is None:
+                        self.error = e
+                return
+            if call == 'checkpoint':
+                done, result = args
+                try:
+                    result.append(self.wrapped_datasaver.checkpoint() if self.error is None else None)
+                except BaseException as e:
+                    self.error = e
+                done.set()
+                continue
+            # after an error the queue is still emptied, such that the measurement loop never blocks on a full queue
+            if self.error is not None:
+                continue
+            try:
+                if call == 'point':
+                    # a value of a point, after the number of points that were skipped before it
+                    call, args, skipped = args
+                    if skipped:
+                        self.wrapped_datasaver.skip_points(skipped)
+                getattr(self.wrapped_datasaver, call)(*args)
+            except BaseException as e:
+                self.error = e
+
+    def _report(self):
+        if not self.reported:
+            self.reported = True
+            warnings.warn(self.databackend.__class__.__name__+' stopped receiving data after an error: '
+                          +repr(self.error))
+
+    def _put(self, call, args=()):
+        # errors of the writer thread are raised in the measurement thread at the next call
+        if self.error is not None:
+            if self.critical:
+                raise self.error
+            self._report()
+            return
+        self.queue.put((call, args))
+
+    def _put_point(self, call, args):
+        # the values of a point, which can be skipped by decimation or dropped when the queue is full
+        if self.points % self.decimate:
+            self.skip_line = True
+            return
+        item = ('point', (call, args, self.skipped))
+        if self.overflow == 'drop' and self.error is None:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                self.skip_line = True
+                return
+        else:
+            self._put(*item)
+        self.skipped = 0
+
+    def bind_layout(self, layout):
+        self.layout = layout
+        self._put('bind_layout', (layout,))
+
+    def add_to_line(self, line):
+        self._put_point('add_to_line', (line,))
+
+    def add_row(self, row):
+        # the row buffer is reused by pysweep for the next point, so it has to be copied
+        self._put_point('add_row', (list(row),))
+
+    def write_line(self):
+        self.points += 1
+        if self.skip_line:
+            self.skip_line = False
+            self.skipped += 1
+            return
+        # the values of this point are in the queue, so the line can not be dropped anymore
+        self._put('write_line')
+
+    def write_block(self):
+        # the points skipped at the end of the block are counted before the block ends
+        if self.skipped:
+            self._put('skip_points', (self.skipped,))
+            self.skipped = 0
+        self._put('write_block')
+
+    def skip_points(self, n):
+        self.skipped += n
+
+    def checkpoint(self):
+        # wait until the writer thread has handled all calls before this one, such that the write position is current
+        done = threading.Event()
+        result = []
+        self._put('checkpoint', (done, result))
+        if not done.is_set() and self.error is not None and not self.critical:
+            return None
+        done.wait()
+        if self.error is not None and self.critical:
+            raise self.error
+        return result[0] if result else None
+
+    def samples_filename(self):
+        return self.wrapped_datasaver.samples_filename()